@@ -2,7 +2,7 @@
 # X4DF
 # Copyright (C) 2017 Eric Kerfoot, King's College London, all rights reserved
 
-from .x4df import readFile, writeFile, idTransform, validFieldTypes, ASCII, BASE64, BASE64_GZ, BINARY, BINARY_GZ, NODE, ELEM, INDEX
+from .x4df import readFile, writeFile, appendToFile, scanFile, scanDirectory, getArrayNbytes, X4DFWriter, areadFile, awriteFile, astreamArray, readArraySlice, registerCodec, codecRegistry, LazyArray, GzipIndex, FileCache, IOStats, ArrayList, TimeIndex, MeshTimes, ImageTimes, idTransform, isIDTransform, validFieldTypes, ASCII, BASE64, BASE64_GZ, BINARY, BINARY_GZ, BINARY_CHUNKED_GZ, NODE, ELEM, INDEX
 from .x4df import dataset, meta, nodes, topology, field, imagedata, mesh, image, transform, array
 
 __appname__='x4df'
@@ -0,0 +1,325 @@
+# X4DF
+# Copyright (C) 2017 Eric Kerfoot, King's College London, all rights reserved
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''
+Benchmarks for the X4DF IO routines. Use command "python benchmark.py" to run them and print the results, see the
+command's --help output for selecting suites and sizes. The "io" suite measures readFile/writeFile times, throughput, 
+and peak memory for synthetic meshes and images in every format with inline, separate file, and shared file storage. 
+Results can be saved as JSON with --json and compared against a previous results file with --compare.
+'''
+
+from __future__ import print_function, division
+import os,sys,timeit,tracemalloc,json,shutil,tempfile,platform,argparse,datetime
+
+from io import StringIO,BytesIO
+
+import numpy as np
+
+
+scriptdir=os.path.dirname(os.path.abspath(__file__))
+rootdir=os.path.join(scriptdir,'..','..')
+
+sys.path.append(rootdir) # add the path to the source since it's assumed to not be installed
+from x4df import parseText, iterArrayText, field, codecRegistry, writeArrayData, decodeArrayData, iterChunks
+from x4df import readFile, writeFile, dataset, mesh, nodes, topology, image, imagedata, array, validFormats, isBinaryFormat
+
+# synthetic dataset sizes as (mesh grid dimension, image volume dimension)
+ioSizes={
+    'small':(100,32),
+    'medium':(300,96),
+    'large':(1000,256),
+}
+
+# array storage layouts: inline in the document, one file per array, or all arrays in one shared file
+ioLayouts=('inline','file','shared')
+
+
+def bestTime(func,repeats=3):
+    '''Returns the best time in seconds of `repeats' calls to `func'.'''
+    return min(timeit.repeat(func,number=1,repeat=repeats))
+
+
+def benchmarkText(rows=1000000,cols=3,dtype='float32'):
+    '''Compare parsing a `rows' by `cols' text array of type `dtype' with parseText() against np.loadtxt.'''
+    data=(np.random.rand(rows,cols)*1000).astype(dtype)
+    text=u'\n'.join(u' '.join(map(str,row)) for row in data.tolist())
+    shape=data.shape
+
+    assert np.all(parseText(text,dtype,None,shape)==data)
+
+    return {
+        'loadtxt':bestTime(lambda:np.loadtxt(StringIO(text),dtype)),
+        'parseText':bestTime(lambda:parseText(text,dtype)),
+        'parseText with shape':bestTime(lambda:parseText(text,dtype,None,shape)),
+    }
+
+
+def benchmarkTextWrite(rows=1000000,cols=3,dtype='float32'):
+    '''Compare formatting a `rows' by `cols' array of type `dtype' as text with iterArrayText() against np.savetxt.'''
+    data=(np.random.rand(rows,cols)*1000).astype(dtype)
+
+    return {
+        'savetxt':bestTime(lambda:np.savetxt(BytesIO(),data,fmt='%s')),
+        'iterArrayText':bestTime(lambda:list(iterArrayText(data))),
+    }
+
+
+def dictrecord(name,members):
+    '''The previous namedrecord() implementation storing members in a per-instance dictionary, used for comparison.'''
+    members=[m.strip() for m in members.split()]
+
+    def _init(obj,*values,**kwvalues):
+        for name,value in list(zip(members,values))+list(kwvalues.items()):
+            setattr(obj,name,value)
+
+    tmembers={m:None for m in members}
+    tmembers['__init__']=_init
+
+    return type(name,(),tmembers)
+
+
+def recordMemory(func,count):
+    '''Returns the bytes allocated per record when creating `count' records with `func'.'''
+    tracemalloc.start()
+    start=tracemalloc.get_traced_memory()[0]
+    records=[func(i) for i in range(count)]
+    size=tracemalloc.get_traced_memory()[0]-start-sys.getsizeof(records)
+    tracemalloc.stop()
+    return size/count
+
+
+def benchmarkRecords(count=100000):
+    '''Compare the construction time and memory of `count' field records against the previous dictionary records.'''
+    dictfield=dictrecord('field','name src timestep topology spatial fieldtype metas')
+    makeslots=lambda i:field('field',i,i,'tris','tris','node',[])
+    makedict=lambda i:dictfield('field',i,i,'tris','tris','node',[])
+
+    return {
+        'dict records':(bestTime(lambda:[makedict(i) for i in range(count)]),recordMemory(makedict,count)),
+        'slots records':(bestTime(lambda:[makeslots(i) for i in range(count)]),recordMemory(makeslots,count)),
+    }
+
+
+def benchmarkCodecs(shape=(32,256,256),compresslevel=None):
+    '''Compare the compressed size, and compression and decompression times, of each binary codec format for an image.'''
+    data=(np.random.rand(*shape)*np.linspace(0,100,shape[-1])).astype('float32')
+    results={}
+    
+    for codec in codecRegistry:
+        for fmt in ('binary_'+codec,'binary_shuffle_'+codec):
+            out=BytesIO()
+            writeArrayData(data,'float32',fmt,out,compresslevel)
+            dat=out.getvalue()
+            
+            results[fmt]=(
+                len(dat),
+                bestTime(lambda:writeArrayData(data,'float32',fmt,BytesIO(),compresslevel)),
+                bestTime(lambda:decodeArrayData(iterChunks(dat),fmt,data.dtype,data.shape)),
+            )
+            
+    return results
+
+
+def peakMemory(func):
+    '''Returns the peak memory in bytes allocated while calling `func', measured with tracemalloc.'''
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def createMesh(dim):
+    '''Returns a dataset with a triangle mesh of a `dim' by `dim' grid of nodes with a node field.'''
+    x,y=np.meshgrid(np.arange(dim),np.arange(dim),indexing='ij')
+    nodedat=np.stack([x.ravel(),y.ravel(),np.sin(x.ravel()*0.1)],axis=1).astype('float32')
+    
+    quads=(np.arange(dim-1)[:,None]*dim+np.arange(dim-1)[None,:]).ravel()
+    tris=np.concatenate([np.stack([quads,quads+dim,quads+1],1),np.stack([quads+1,quads+dim,quads+dim+1],1)])
+    
+    arrs=[
+        array('nodes',type='float32',data=nodedat),
+        array('tris',type='int32',data=tris.astype('int32')),
+        array('field',type='float32',data=nodedat[:,2:].copy()),
+    ]
+    m=mesh('grid',None,[nodes('nodes')],[topology('tris','tris','Tri1NL')])
+    
+    return dataset([m],None,arrs)
+
+
+def createImage(dim):
+    '''Returns a dataset with a `dim' cubed image volume of smoothly varying values.'''
+    z,y,x=np.ogrid[:dim,:dim,:dim]
+    dat=(np.sin(x*0.1)+np.cos(y*0.2)*z/dim).astype('float32').reshape((1,dim,dim,dim))
+    img=image('volume',None,None,[imagedata('volume')])
+    
+    return dataset(None,[img],[array('volume',type='float32',data=dat)])
+
+
+def benchmarkIO(sizes=('small',),formats=validFormats,layouts=ioLayouts,repeats=3):
+    '''
+    Measure writing and reading synthetic mesh and image datasets of each size in `sizes' (keys of ioSizes) in each
+    format of `formats' with each layout in `layouts'. Returns a list of result dictionaries each stating the dataset,
+    size, format, layout, raw data bytes, stored bytes, best write and read times of `repeats' runs, throughputs in 
+    bytes of raw data per second, and the peak memory allocated while writing and reading.
+    '''
+    results=[]
+    tempdir=tempfile.mkdtemp()
+    
+    try:
+        for size in sizes:
+            meshdim,imagedim=ioSizes[size]
+            
+            for name,ds in (('mesh',createMesh(meshdim)),('image',createImage(imagedim))):
+                nbytes=sum(a.data.nbytes for a in ds.arrays)
+                
+                for fmt in formats:
+                    for layout in layouts:
+                        if layout=='inline' and isBinaryFormat(fmt):
+                            continue # binary data must be stored in separate files
+                        
+                        shutil.rmtree(tempdir)
+                        os.mkdir(tempdir)
+                        
+                        for i,arr in enumerate(ds.arrays):
+                            arr.format=fmt
+                            arr.shape=None
+                            arr.filename=None if layout=='inline' else 'shared.dat' if layout=='shared' else 'array%i.dat'%i
+                            
+                        filename=os.path.join(tempdir,'bench.x4df')
+                        write=lambda:writeFile(ds,filename)
+                        read=lambda:readFile(filename)
+                        
+                        write()
+                        readds=read()
+                        for arr,readarr in zip(ds.arrays,readds.arrays):
+                            assert np.all(np.asarray(readarr.data).reshape(arr.data.shape)==arr.data), (name,fmt,layout)
+                            
+                        writeTime=bestTime(write,repeats)
+                        readTime=bestTime(read,repeats)
+                        
+                        results.append({
+                            'dataset':name,
+                            'size':size,
+                            'format':fmt,
+                            'layout':layout,
+                            'dataBytes':nbytes,
+                            'storedBytes':sum(os.path.getsize(os.path.join(tempdir,f)) for f in os.listdir(tempdir)),
+                            'writeTime':writeTime,
+                            'readTime':readTime,
+                            'writeThroughput':nbytes/writeTime,
+                            'readThroughput':nbytes/readTime,
+                            'writePeakMemory':peakMemory(write),
+                            'readPeakMemory':peakMemory(read),
+                        })
+    finally:
+        shutil.rmtree(tempdir)
+        
+    return results
+
+
+def compareResults(oldresults,newresults,threshold=1.1):
+    '''
+    Compare the io results `newresults' against `oldresults', returning a list of (key,measure,oldvalue,newvalue) tuples
+    for each time or peak memory measure which increased by more than the factor `threshold'.
+    '''
+    measures=('writeTime','readTime','writePeakMemory','readPeakMemory')
+    keyfunc=lambda r:(r['dataset'],r['size'],r['format'],r['layout'])
+    old={keyfunc(r):r for r in oldresults}
+    regressions=[]
+    
+    for r in newresults:
+        o=old.get(keyfunc(r))
+        if o is not None:
+            regressions+=[(keyfunc(r),m,o[m],r[m]) for m in measures if r[m]>o[m]*threshold]
+            
+    return regressions
+
+
+def benchmarkInfo():
+    '''Returns a dictionary describing the environment the benchmarks are run in.'''
+    return {
+        'date':datetime.datetime.now().isoformat(),
+        'python':platform.python_version(),
+        'numpy':np.__version__,
+        'platform':platform.platform(),
+        'cpus':os.cpu_count(),
+    }
+
+
+def printMicroBenchmarks():
+    '''Run the text, record, and codec benchmarks and print the results.'''
+    for dtype in ('float32','int32'):
+        print('Text parsing, 1000000x3 %s:'%dtype)
+        for name,secs in benchmarkText(dtype=dtype).items():
+            print('  %-24s %.3fs'%(name,secs))
+
+        print('Text formatting, 1000000x3 %s:'%dtype)
+        for name,secs in benchmarkTextWrite(dtype=dtype).items():
+            print('  %-24s %.3fs'%(name,secs))
+
+    print('Creating 100000 field records:')
+    for name,(secs,size) in benchmarkRecords().items():
+        print('  %-24s %.3fs %.1f bytes/record'%(name,secs,size))
+
+    print('Compressing 32x256x256 float32 image:')
+    for name,(size,comptime,decomptime) in benchmarkCodecs().items():
+        print('  %-24s %10i bytes, compress %.3fs, decompress %.3fs'%(name,size,comptime,decomptime))
+
+
+if __name__=='__main__':
+    parser=argparse.ArgumentParser(description='Run X4DF benchmarks.')
+    parser.add_argument('--suite',choices=('micro','io','all'),default='all',help='Benchmark suite to run')
+    parser.add_argument('--sizes',default='small,medium',help='Comma-separated io dataset sizes from: '+', '.join(ioSizes))
+    parser.add_argument('--formats',default=','.join(validFormats),help='Comma-separated io array formats')
+    parser.add_argument('--repeats',type=int,default=3,help='Number of runs to take the best time from')
+    parser.add_argument('--json',help='Save io results and environment information to this JSON file')
+    parser.add_argument('--compare',help='Report io regressions against this JSON results file')
+    parser.add_argument('--threshold',type=float,default=1.1,help='Ratio above which an increase is a regression')
+    args=parser.parse_args()
+    
+    if args.suite in ('micro','all'):
+        printMicroBenchmarks()
+        
+    if args.suite in ('io','all'):
+        results=benchmarkIO(args.sizes.split(','),args.formats.split(','),ioLayouts,args.repeats)
+        
+        print('%-6s %-7s %-18s %-7s %12s %10s %10s %10s %10s %12s'%('Data','Size','Format','Layout','Stored',
+              'Write s','Read s','Write MB/s','Read MB/s','Read peak MB'))
+        for r in results:
+            print('%-6s %-7s %-18s %-7s %12i %10.3f %10.3f %10.1f %10.1f %12.1f'%(r['dataset'],r['size'],r['format'],
+                  r['layout'],r['storedBytes'],r['writeTime'],r['readTime'],r['writeThroughput']/1e6,
+                  r['readThroughput']/1e6,r['readPeakMemory']/1e6))
+            
+        if args.json:
+            with open(args.json,'w') as o:
+                json.dump({'info':benchmarkInfo(),'results':results},o,indent=1)
+                
+        if args.compare:
+            with open(args.compare) as o:
+                regressions=compareResults(json.load(o)['results'],results,args.threshold)
+                
+            for key,measure,oldval,newval in regressions:
+                print('Regression %s %s: %g -> %g'%('/'.join(key),measure,oldval,newval))
+                
+            if regressions:
+                sys.exit(1)
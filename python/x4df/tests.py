@@ -24,7 +24,9 @@ Unit tests to run with Nose. Use command "nosetests tests.py" or "python tests.p
 '''
 
 from __future__ import print_function, division
-import os,sys,glob,unittest,shutil,tempfile, base64, gzip
+import os,sys,glob,unittest,shutil,tempfile, base64, gzip, pickle, asyncio
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
 import xml.etree.ElementTree
 
 from io import StringIO,BytesIO
@@ -37,8 +39,10 @@ rootdir=os.path.join(scriptdir,'..','..')
 testdir=os.path.join(rootdir,'testdata')
 
 sys.path.append(rootdir) # add the path to the source since it's assumed to not be installed
-from x4df import nodes, topology, mesh, array, meta, dataset, image, transform, imagedata, writeFile, readFile
-from x4df import BASE64_GZ, BASE64, BINARY, BINARY_GZ, B64LINELEN
+from x4df import nodes, topology, mesh, array, meta, dataset, field, image, transform, imagedata, writeFile, readFile, MeshTimes, ImageTimes, appendToFile, X4DFWriter
+from x4df import areadFile, awriteFile, astreamArray, scanFile, scanDirectory, getArrayNbytes, isIDTransform
+import x4df
+from x4df import BASE64_GZ, BASE64, BINARY, BINARY_GZ, BINARY_CHUNKED_GZ, B64LINELEN, GzipIndex, readText, readArraySlice, codecRegistry, IOStats, FileCache
 
 trimeshxml=u'''<?xml version="1.0" encoding="UTF-8"?>
 <x4df>
@@ -119,6 +123,158 @@ class TestIO(unittest.TestCase):
         writeFile(obj,s)
         self.assertEqual(s.getvalue().strip(),trimeshxml.strip(),'Writer not writing XML identical to source')
         
+    def testRecordPickle(self):
+        '''Test records compare by value, reject unknown members, and pickle.'''
+        obj=readFile(StringIO(trimeshxml))
+        obj1=pickle.loads(pickle.dumps(obj))
+        self.assertEqual(obj,obj1,'Pickled dataset not equal to original')
+        
+        obj1.meshes[0].name='other'
+        self.assertNotEqual(obj,obj1,'Changed dataset equal to original')
+        self.assertEqual(2,len({obj.meshes[0],obj1.meshes[0],obj.meshes[0]})) # hashed by identity
+        
+        with self.assertRaises(AttributeError):
+            obj.notamember=None
+        
+    def testArrayLookup(self):
+        '''Test looking up arrays by name after modifying the array list and resolving mesh references.'''
+        obj=readFile(StringIO(trimeshxml))
+        m=obj.meshes[0]
+        
+        self.assertEqual(obj.getArray('trismat').shape,'1 3')
+        self.assertTrue(np.all(m.getNodes(obj)[0]==obj.arrays[0].data))
+        self.assertTrue(np.all(m.getTopologies(obj)['tris']==[[1,0,2]]))
+        
+        obj.arrays.append(array('field',data=np.arange(3)))
+        obj.arrays.append(array('field2',data=np.arange(3)*2))
+        m.fields=[field('vals','field',None,'tris'),field('vals','field2',None,'tris')]
+        self.assertTrue(np.all(m.getFields(obj,'vals')[1]==[0,2,4]))
+        
+        obj.arrays[0].name='renamed'
+        self.assertIs(obj.getArray('renamed'),obj.arrays[0])
+        
+        obj.arrays[0].name='field2' # an earlier array renamed to an indexed name is found first
+        self.assertIs(obj.getArray('field2'),obj.arrays[0])
+        obj.arrays[0].name='renamed'
+        self.assertIs(obj.getArray('field2'),obj.arrays[-1])
+        
+        del obj.arrays[0]
+        with self.assertRaises(KeyError):
+            obj.getArray('renamed')
+            
+        other=readFile(StringIO(trimeshxml))
+        other.getArray('nodesmat')
+        obj.arrays[0].name='trismat2' # renaming an array only discards the indices of lists containing it
+        self.assertIsNotNone(other.arrays.nameindex)
+        self.assertIs(obj.getArray('trismat2'),obj.arrays[0])
+        
+        arrs=[]
+        ds=dataset(None,None,arrs) # plain lists are stored as given and searched
+        arrs.append(array('added'))
+        self.assertIs(ds.getArray('added'),arrs[0])
+        
+    def testMeshTimes(self):
+        '''Test looking up lazily-loaded node and field data by time using timescheme and timestep definitions.'''
+        nodedat=[np.random.rand(3,3) for i in range(3)]
+        arrs=[array('nodes%i'%i,data=nodedat[i]) for i in range(3)]
+        arrs+=[array('field0',data=np.arange(3)),array('field1',data=np.arange(3)*2)]
+        
+        fields=[field('vals','field1','5','tris'),field('vals','field0','1','tris')]
+        m=mesh('triangle',None,[nodes('nodes%i'%i,None,str(i)) for i in range(3)],[],fields)
+        writeFile(dataset([m],None,arrs),self.mfile)
+        
+        ds=readFile(self.mfile,lazy=True)
+        times=MeshTimes(ds.meshes[0],ds)
+        
+        self.assertTrue(np.allclose(times.nodesAt(1.5),nodedat[1]))
+        self.assertEqual(times.fieldAt('vals',0).tolist(),[0,1,2])
+        self.assertEqual(times.fieldAt('vals',6).tolist(),[0,2,4])
+        self.assertEqual([a.data.loaded for a in ds.arrays],[False,True,False,True,True])
+        
+        n1,n2,v=times.nodesNeighbours(1.25)
+        self.assertTrue(np.allclose(n2,nodedat[2]))
+        self.assertAlmostEqual(v,0.25)
+        
+        ds.meshes[0].timescheme=(0,0.5) # nodes at 0, 0.5, 1.0, fields at 0 then 0.5
+        times=MeshTimes(ds.meshes[0],ds)
+        self.assertTrue(np.allclose(times.nodesAt(0.75),nodedat[1]))
+        self.assertEqual(times.fieldAt('vals',0.25).tolist(),[0,2,4])
+        
+    def testImageTimes(self):
+        '''Test multiple imagedata are placed in time by their timesteps, ignoring the image's timescheme.'''
+        frames=[np.random.rand(4,4,2,1) for i in range(2)]
+        arrs=[array('frame%i'%i,data=frames[i]) for i in range(2)]
+        img=image('img',(0,1),None,[imagedata('frame0','10'),imagedata('frame1','20')])
+        ds=dataset(None,[img],arrs)
+        times=ImageTimes(img,ds)
+        
+        self.assertEqual('frame0',times.imagedataAt(15).src)
+        self.assertEqual('frame1',times.imagedataAt(20).src)
+        self.assertTrue(np.all(times.dataAt(5)==frames[0]))
+        
+    def testImageTimes4D(self):
+        '''Test a single 4D imagedata with a timescheme is indexed by time along its time dimension.'''
+        dat=np.random.rand(4,5,3,6).astype(np.float32)
+        img=image('img',(1,0.5),None,[imagedata('vol')])
+        writeFile(dataset(None,[img],[array('vol',format=BINARY,filename=self.dfile,data=dat)]),self.ifile)
+        ds=readFile(self.ifile,lazy=True)
+        times=ImageTimes(ds.images[0],ds)
+        
+        self.assertTrue(np.all(times.dataAt(2.2)==dat[:,:,:,2]))
+        self.assertTrue(np.all(times.dataAt(0)==dat[:,:,:,0]))
+        self.assertTrue(ds.arrays[0].data.loaded) # the array is loaded once for all frames
+        
+        d1,d2,v=times.dataNeighbours(1.75)
+        self.assertTrue(np.all(d1==dat[:,:,:,1]))
+        self.assertTrue(np.all(d2==dat[:,:,:,2]))
+        self.assertAlmostEqual(v,0.5)
+        
+    def testImageTimesPlayback(self):
+        '''Test playing back every frame of a lazily read 4D image reads its file once.'''
+        dat=np.random.rand(128,128,32,10).astype(np.float32)
+        img=image('img',(0,1),None,[imagedata('vol')])
+        writeFile(dataset(None,[img],[array('vol',format=BINARY,filename=self.dfile,data=dat)]),self.ifile)
+        
+        stats=IOStats()
+        ds=readFile(self.ifile,lazy=True,stats=stats)
+        times=ImageTimes(ds.images[0],ds)
+        
+        for t in range(dat.shape[3]):
+            self.assertTrue(np.all(times.dataAt(t+0.5)==dat[:,:,:,t]))
+            
+        self.assertEqual(1,stats.arrays['vol']['fileread'][0])
+        
+    def testTransformPoints(self):
+        '''Test the transform matrix and mapping voxel grids and points between image and world space.'''
+        rmat=np.asarray([[1,0,0],[0,0,-1],[0,1,0]])
+        t=transform(np.asarray([1,2,3]),rmat.flatten(),np.asarray([10,20,30]))
+        
+        self.assertTrue(np.allclose(t.getMatrix()[:3],[[10,0,0,1],[0,0,-30,2],[0,20,0,3]]))
+        self.assertTrue(np.allclose(t.toWorld([1,1,1]),[11,-28,23]))
+        
+        dims=(4,5,6)
+        grid=t.voxelGrid(dims)
+        inds=np.stack(np.meshgrid(*[np.arange(d) for d in dims],indexing='ij'),axis=-1)
+        
+        self.assertEqual(grid.shape,dims+(3,))
+        self.assertTrue(np.allclose(grid,t.voxelsToWorld(inds,dims)))
+        self.assertTrue(np.allclose(t.worldToVoxels(grid,dims),inds))
+        
+        t.position=np.zeros(3) # cached matrices must be recomputed
+        self.assertTrue(np.allclose(t.toWorld([0,0,0]),0))
+        
+    def testSingularTransformWrite(self):
+        '''Test writing and reading an image plane whose transform has a zero scale component and so no inverse.'''
+        t=transform(np.asarray([1,2,3]),np.eye(3).flatten(),np.asarray([10,10,0]))
+        img=image('plane',None,None,[imagedata('plane',None,t)])
+        writeFile(dataset(None,[img],[array('plane',data=np.ones((4,4)))]),self.ifile)
+        ds=readFile(self.ifile)
+        
+        self.assertTrue(np.allclose(ds.images[0].imagedata[0].transform.scale,[10,10,0]))
+        self.assertTrue(np.allclose(t.toWorld([1,1,0]),[11,12,3]))
+        self.assertFalse(isIDTransform(t))
+        self.assertTrue(isIDTransform(transform(np.zeros(3),np.eye(3),np.ones(3))))
+        
     def testBadString(self):
         '''Test correct raise of ParseError on bad input to readFile().'''
         with self.assertRaises(xml.etree.ElementTree.ParseError):
@@ -173,6 +329,21 @@ class TestIO(unittest.TestCase):
         with open(mesh.arrays[0].filename,'rb') as o:
             self.assertEqual(o.read(),binary,'Bad binary file contents')        
             
+    def testWriteNoOverwrite(self):
+        '''Test writing multiple arrays to a new separate file without overwriting, then again leaving it untouched.'''
+        mesh=createTriMeshDS(BINARY,self.dfile,self.dfile)
+        writeFile(mesh,self.mfile,False)
+
+        self.assertEqual(mesh.arrays[1].offset,36,'Bad index array offset')
+        self.assertEqual(os.path.getsize(self.dfile),39,'Bad binary file size')
+
+        mesh.arrays[0].data=mesh.arrays[0].data*2
+        writeFile(mesh,self.mfile,False)
+
+        ds=readFile(self.mfile)
+        self.assertTrue(np.all(ds.arrays[0].data==mesh.arrays[0].data/2),'Existing file was overwritten')
+        self.assertTrue(np.all(ds.arrays[1].data==mesh.arrays[1].data),'Bad index array data')
+
     def testWriteB64File1(self):
         '''Test writing one array to a separate b64 file.'''
         mesh=createTriMeshDS(BASE64,self.dfile)
@@ -302,6 +473,568 @@ class TestIO(unittest.TestCase):
         self.assertTrue(np.all(self.trimeshB64.arrays[0].data==ds.arrays[0].data),'Base64 data not the same as original')
         self.assertTrue(np.all(ds.arrays[0].data==ds1.arrays[0].data),'Base64 and Base64_gz data not the same')
     
+    def testLazyRead(self):
+        '''Test reading arrays lazily, ensuring data is only loaded when accessed and is the same as eager reading.'''
+        mesh=createTriMeshDS(BASE64_GZ,self.dfile,self.dfile)
+        writeFile(mesh,self.mfile)
+
+        ds=readFile(self.mfile,lazy=True)
+        nodear=ds.arrays[0]
+
+        self.assertEqual(nodear.name,'nodesmat')
+        self.assertEqual(nodear.format,BASE64_GZ)
+        self.assertFalse(nodear.data.loaded,'Lazy array loaded before access')
+        self.assertEqual(nodear.data.shape,(3,3))
+        self.assertTrue(nodear.data.loaded,'Lazy array not loaded after access')
+        self.assertTrue(np.all(nodear.data==mesh.arrays[0].data),'Lazy data not the same as original')
+        self.assertTrue(np.all(np.asarray(ds.arrays[1].data)==readFile(self.mfile).arrays[1].data),'Lazy data not the same as eager')
+
+    def testLazyEquality(self):
+        '''Test datasets and arrays read lazily compare by the contents of their data.'''
+        writeFile(self.trimeshB64,self.mfile)
+        ds=readFile(self.mfile,lazy=True)
+        
+        self.assertEqual(ds,readFile(self.mfile,lazy=True))
+        self.assertEqual(ds.arrays[0],readFile(self.mfile).arrays[0])
+        
+        ds1=readFile(self.mfile,lazy=True)
+        ds1.arrays[0].data=ds1.arrays[0].data+1
+        self.assertNotEqual(ds,ds1)
+        
+    def testLazyOperators(self):
+        '''Test arithmetic and comparison operators and ufuncs applied to lazy arrays use the loaded data.'''
+        mesh=createTriMeshDS(BASE64_GZ,self.dfile,self.dfile)
+        writeFile(mesh,self.mfile)
+        
+        lazy=readFile(self.mfile,lazy=True).arrays[0].data
+        other=readFile(self.mfile,lazy=True).arrays[0].data
+        dat=mesh.arrays[0].data
+        
+        self.assertTrue(np.all(lazy+1==dat+1))
+        self.assertTrue(np.all(2*lazy==dat*2))
+        self.assertEqual((lazy==other).shape,dat.shape)
+        self.assertTrue(np.all(lazy==other))
+        self.assertTrue(np.all(np.sqrt(lazy)==np.sqrt(dat)))
+        self.assertTrue(np.all((lazy>=1)==(dat>=1)))
+
+    def testMemmapRead(self):
+        '''Test memory-mapping binary arrays from a multi-array file.'''
+        nodedat=np.arange(9,dtype=np.float32).reshape((3,3))
+        indsdat=np.asarray([(1,0,2)],np.uint8)
+
+        with open(self.dfile,'wb') as o:
+            o.write(nodedat.tobytes()+indsdat.tobytes())
+
+        doc='''<x4df>
+         <array name="nodesmat" shape="3 3" format="binary" filename="%(f)s" offset="0" size="36"/>
+         <array name="trismat" shape="1 3" type="uint8" format="binary" filename="%(f)s" offset="36" size="3"/>
+        </x4df>'''%{'f':self.dfile}
+
+        ds=readFile(doc,mmap=True)
+        self.assertIsInstance(ds.arrays[0].data,np.memmap)
+        self.assertFalse(ds.arrays[0].data.flags.writeable,'Mapped array should be read-only')
+        self.assertTrue(np.all(ds.arrays[0].data==nodedat),'Mapped node data not the same as original')
+        self.assertTrue(np.all(ds.arrays[1].data==indsdat),'Mapped index data not the same as original')
+
+        ds=readFile(doc,mmap='c')
+        ds.arrays[0].data[0,0]=100
+        self.assertTrue(np.all(readFile(doc).arrays[0].data==nodedat),'Copy-on-write mapping altered file')
+
+    def testInterleavedRead(self):
+        '''Test reading a document with arrays, meshes, and metadata in mixed order.'''
+        doc='''<x4df>
+         <array name="trismat" shape="1 3" type="uint8">1 0 2</array>
+         <meta name="first" val="1"/>
+         <mesh name="triangle">
+          <nodes src="nodesmat"><meta name="nodemeta" val="2"/></nodes>
+          <topology name="tris" src="trismat" elemtype="Tri1NL"/>
+         </mesh>
+         <array name="nodesmat">0.0 0.0 0.0
+         1.0 0.0 0.0
+         0.0 1.0 0.0</array>
+         <meta name="second"><child>text</child></meta>
+        </x4df>'''
+
+        ds=readFile(doc)
+        self.assertEqual([a.name for a in ds.arrays],['trismat','nodesmat'])
+        self.assertEqual([m.name for m in ds.metas],['first','second'])
+        self.assertEqual(ds.metas[1].children[0].text,'text')
+        self.assertEqual(ds.meshes[0].nodes[0].metas[0].val,'2')
+        self.assertEqual(ds.arrays[1].data.shape,(3,3))
+
+    def testParallelRead(self):
+        '''Test reading arrays with thread and process pools produces the same arrays in the same order.'''
+        mesh=createTriMeshDS(BASE64_GZ,self.dfile,self.dfile)
+        writeFile(mesh,self.mfile)
+
+        for processes in (False,True):
+            ds=readFile(self.mfile,workers=2,processes=processes)
+            self.assertEqual([a.name for a in ds.arrays],['nodesmat','trismat'])
+
+            for a,b in zip(ds.arrays,mesh.arrays):
+                self.assertTrue(np.all(a.data==b.data),'Array %r not the same as original'%a.name)
+
+    def testParallelWrite(self):
+        '''Test writing arrays with thread and process pools, including compressing a large array in blocks.'''
+        imgdata=np.random.rand(10,20,30).astype(np.float32)
+        ds=createTriMeshDS(BASE64_GZ,self.dfile,self.dfile)
+        ds.arrays.append(array('image',type='float32',format=BASE64_GZ,data=imgdata))
+        
+        for fmt in ('binary_zlib','base64_shuffle_gz','binary_shuffle_lzma'): # other codecs also compress in blocks
+            ds.arrays.append(array(fmt,type='float32',format=fmt,filename=self.dfile,data=imgdata))
+
+        for processes in (False,True):
+            writeFile(ds,self.mfile,workers=2,processes=processes,blocksize=1000)
+            ds1=readFile(self.mfile)
+
+            self.assertEqual([a.name for a in ds1.arrays[:3]],['nodesmat','trismat','image'])
+            self.assertEqual(int(ds1.arrays[1].offset),ds.arrays[0].size,'Bad index array offset')
+
+            for a,b in zip(ds1.arrays,ds.arrays):
+                self.assertTrue(np.all(a.data==b.data),'Array %r not the same as original'%a.name)
+
+    def testGzipIndex(self):
+        '''Test reading sections of a gzip file with multiple members using a seek point index.'''
+        dat=np.random.randint(0,8,100000).astype(np.uint8).tobytes()
+
+        with gzip.open(self.dfile+'.gz','wb') as o:
+            o.write(dat[:60000])
+        with gzip.open(self.dfile+'.gz','ab') as o:
+            o.write(dat[60000:])
+
+        index=GzipIndex(self.dfile+'.gz',spacing=5000,chunksize=1000)
+        self.assertEqual(index.size,len(dat))
+        self.assertGreater(len(index.points),3,'Index has too few seek points')
+
+        for offset,size in [(0,10),(12345,20000),(59990,20),(60000,100),(99000,None)]:
+            end=None if size is None else offset+size
+            self.assertEqual(index.read(offset,size),dat[offset:end],'Bad data read at %i'%offset)
+
+    def testGzipIndexRead(self):
+        '''Test reading arrays from a multi-array .gz file with a seek point index.'''
+        mesh=createTriMeshDS(BINARY,self.dfile+'.gz',self.dfile+'.gz')
+        writeFile(mesh,self.mfile)
+
+        ds=readFile(self.mfile,lazy=True,gzindex=True)
+        self.assertTrue(np.all(ds.arrays[1].data==mesh.arrays[1].data),'Bad index array data')
+        self.assertTrue(np.all(ds.arrays[0].data==mesh.arrays[0].data),'Bad node array data')
+
+    def testTextRead(self):
+        '''Test reading text arrays from a file with offsets, sizes, separators, and shapes matches np.loadtxt.'''
+        with open(self.dfile,'w') as o:
+            o.write('1,2,3\n4,5,6\n7,8,9\n10,11,12\n')
+
+        expected=np.loadtxt(self.dfile,np.float32,delimiter=',')
+
+        self.assertTrue(np.all(readText(self.dfile,np.float32,0,',')==expected))
+        self.assertTrue(np.all(readText(self.dfile,np.float32,1,',',None,2)==expected[1:3]))
+        self.assertTrue(np.all(readText(self.dfile,np.int32,3,',')==expected[3]))
+        self.assertTrue(np.all(readText(self.dfile,np.float32,2,',',(2,1,3))==expected[2:].reshape((2,1,3))))
+
+        with self.assertRaises(ValueError):
+            readText(StringIO(u'1 2 3\n4 5\n'),np.float32,0,None)
+
+        for text,shape in ((u'1,2,3\n4,5,6',None),(u'1 2 3\n4 5\n6',None),(u'1 2\n3 x',None),(u'1 2 3',(2,2))):
+            with self.assertRaises(ValueError):
+                readText(StringIO(text),np.float32,0,None,shape)
+
+    def testTextWriteRead(self):
+        '''Test writing and reading 3D text arrays inline and in files, and that the text matches np.savetxt.'''
+        floatdat=np.random.rand(4,3,2).astype(np.float32)
+        intdat=np.random.randint(0,1000,(2,3,4))
+
+        ds=dataset(None,None,[array('floats','4 3 2',data=floatdat),array('ints','2 3 4',type='int32',data=intdat),
+                              array('floatfile','4 3 2',filename=self.dfile,data=floatdat)])
+        writeFile(ds,self.mfile)
+        ds1=readFile(self.mfile)
+
+        self.assertTrue(np.all(ds1.arrays[0].data==floatdat),'Inline float data not read back exactly')
+        self.assertTrue(np.all(ds1.arrays[1].data==intdat),'Inline int data not read back exactly')
+        self.assertTrue(np.all(ds1.arrays[2].data==floatdat),'File float data not read back exactly')
+
+        expected=BytesIO()
+        np.savetxt(expected,floatdat.reshape((12,2)),fmt='%s')
+
+        with open(self.dfile,'rb') as o:
+            self.assertEqual(o.read(),expected.getvalue(),'Text not formatted the same as np.savetxt')
+
+    def testStreamingWriteRead(self):
+        '''Test writing and reading arrays larger than the encoding chunk size inline and in files for each format.'''
+        dat=np.random.rand(300000,3).astype(np.float32)
+        arrs=[array('inline',format=BASE64_GZ,data=dat),array('inlineb64',format=BASE64,data=dat)]
+        arrs+=[array(f,format=f,filename=self.dfile,data=dat) for f in (BASE64,BASE64_GZ,BINARY,BINARY_GZ)]
+
+        writeFile(dataset(None,None,arrs),self.mfile)
+        ds1=readFile(self.mfile)
+
+        for arr in ds1.arrays:
+            self.assertTrue(np.all(arr.data==dat),'Data for %r not read back exactly'%arr.name)
+
+        with open(self.mfile) as o:
+            lines=[l.strip() for l in o if l.strip() and l.strip()[0]!='<']
+
+        self.assertTrue(all(len(l)<=B64LINELEN for l in lines),'Inline base64 lines too long')
+
+    def testSliceRead(self):
+        '''Test reading slices of binary arrays in plain and .gz files without loading whole arrays.'''
+        dat=np.random.rand(4,5,6,7).astype(np.float32)
+        gzfile=self.dfile+'.gz'
+        arrs=[array('pad',format=BINARY,filename=self.dfile,data=np.ones(3))]
+        arrs+=[array('img',format=BINARY,filename=f,data=dat) for f in (self.dfile,gzfile)]
+        writeFile(dataset(None,None,arrs),self.mfile)
+        
+        ds=readFile(self.mfile,lazy=True,gzindex=True)
+        for runbytes in (x4df.SLICERUNBYTES,0): # read as spans of rows, then as individual runs
+            with mock.patch.object(x4df,'SLICERUNBYTES',runbytes):
+                for key in [(2,slice(1,4)),(slice(None),3,slice(None,None,2)),(Ellipsis,1),(slice(None,None,-1),)]:
+                    for arr in ds.arrays[1:]:
+                        msg='Slice %r of %r not read correctly'%(key,arr.filename)
+                        self.assertTrue(np.all(arr.data[key]==dat[key]),msg)
+                        self.assertFalse(arr.data.loaded)
+                
+        arr=array('img','4 5 6 7',None,'float32',BINARY,ds.arrays[1].offset,None,os.path.basename(self.dfile))
+        self.assertTrue(np.all(readArraySlice(arr,(1,2),self.tempdir)==dat[1,2]))
+        
+    def testSliceReadCount(self):
+        '''Test slicing the last axis of a lazily read image reads the file once rather than once per element.'''
+        dat=np.random.rand(128,128,32,10).astype(np.float32)
+        gzfile=self.dfile+'.gz'
+        arrs=[array(n,format=BINARY,filename=f,data=dat) for n,f in (('plain',self.dfile),('gz',gzfile))]
+        writeFile(dataset(None,None,arrs),self.mfile)
+        
+        stats=IOStats()
+        ds=readFile(self.mfile,lazy=True,gzindex=True,stats=stats)
+        
+        for arr,stage in zip(ds.arrays,('fileread','decompress')):
+            self.assertTrue(np.all(arr.data[...,3]==dat[...,3]))
+            self.assertTrue(np.all(arr.data[2:4,...,5]==dat[2:4,...,5]))
+            self.assertEqual(2,stats.arrays[arr.name][stage][0]) # one read for each slice
+        
+    def testChunkedWriteRead(self):
+        '''Test writing and reading binary_chunked_gz arrays whole and by slices of chunks, with and without workers.'''
+        dat=np.random.rand(40,100,100).astype(np.float32) # 26 rows per 1MB chunk
+        arrs=[array('chunked%i'%i,format=BINARY_CHUNKED_GZ,filename=self.dfile,data=dat) for i in range(2)]
+        
+        for workers in (None,2):
+            writeFile(dataset(None,None,arrs),self.mfile,workers=workers,blocksize=1<<18)
+            ds=readFile(self.mfile,lazy=True)
+            
+            self.assertTrue(np.all(ds.arrays[1].data[30:35,2]==dat[30:35,2]))
+            self.assertTrue(np.all(ds.arrays[1].data[::7,1:3,-1]==dat[::7,1:3,-1]))
+            self.assertFalse(ds.arrays[1].data.loaded)
+            
+            for arr in ds.arrays:
+                self.assertTrue(np.all(np.asarray(arr.data)==dat))
+                
+        with ThreadPoolExecutor(2) as executor, mock.patch.object(executor,'map',wraps=executor.map) as mapped:
+            ds=readFile(self.mfile,workers=executor)
+            
+            self.assertTrue(np.all(ds.arrays[1].data==dat))
+            self.assertEqual(2,mapped.call_count) # the chunks of each array are decompressed by the executor
+                
+        with self.assertRaises(ValueError):
+            writeFile(dataset(None,None,[array('chunked',format=BINARY_CHUNKED_GZ,data=dat)]),self.mfile)
+            
+    def testLazyFallbackLoads(self):
+        '''Test lazy array accesses which can't be read as partial slices load the array once.'''
+        dat=np.random.rand(10,4).astype(np.float32)
+        arrs=[array('bin',format=BINARY,filename=self.dfile,data=dat)]
+        arrs.append(array('chunked',format=BINARY_CHUNKED_GZ,filename=self.dfile+'.gz',data=dat))
+        writeFile(dataset(None,None,arrs),self.mfile)
+        
+        stats=IOStats()
+        ds=readFile(self.mfile,lazy=True,stats=stats)
+        
+        self.assertTrue(np.all(ds.getData('bin')[2]==dat[2])) # partial read
+        self.assertFalse(ds.arrays[0].data.loaded)
+        
+        for i in range(3):
+            self.assertTrue(np.all(ds.getData('bin')[[i,i+1]]==dat[[i,i+1]]))
+            self.assertTrue(np.all(ds.getData('chunked')[i]==dat[i]))
+            
+        self.assertTrue(all(a.data.loaded for a in ds.arrays))
+        self.assertEqual(2,stats.cacheMisses) # each file is read once
+        
+    def testChunkedEmpty(self):
+        '''Test writing and reading binary_chunked_gz arrays with no rows.'''
+        dats=[np.zeros((0,3),np.float32),np.zeros((0,),np.float32),np.zeros((3,0),np.float32)]
+        arrs=[array('empty%i'%i,format=BINARY_CHUNKED_GZ,filename=self.dfile,data=d) for i,d in enumerate(dats)]
+        writeFile(dataset(None,None,arrs),self.mfile)
+        
+        for lazy in (False,True):
+            ds=readFile(self.mfile,lazy=lazy)
+            for arr,dat in zip(ds.arrays,dats):
+                self.assertEqual(dat.shape,np.asarray(arr.data).shape)
+                
+        ds=readFile(self.mfile,lazy=True)
+        self.assertEqual((0,3),ds.arrays[0].data[:].shape)
+        
+    def testCodecWriteRead(self):
+        '''Test writing and reading arrays with each registered codec, shuffled and not, with a compression level.'''
+        dat=np.random.randint(0,1000,(50,40)).astype(np.int32)
+        formats=['%s_%s%s'%(b,s,c) for b in ('binary','base64') for s in ('','shuffle_') for c in codecRegistry]
+        arrs=[array(f,format=f,filename=self.dfile,data=dat) for f in formats]
+        arrs.append(array('inline',format='base64_shuffle_zlib',data=dat))
+        
+        writeFile(dataset(None,None,arrs),self.mfile,compresslevel=1)
+        ds1=readFile(self.mfile)
+        
+        for arr in ds1.arrays:
+            self.assertTrue(np.all(arr.data==dat),'Data for format %r not read back exactly'%arr.format)
+            
+        with self.assertRaises((AssertionError,ValueError)):
+            writeFile(dataset(None,None,[array('bad',format='binary_notacodec',filename=self.dfile,data=dat)]),self.mfile)
+            
+        with self.assertRaises(ValueError):
+            writeFile(dataset(None,None,[array('inline',format='binary_zlib',data=dat)]),self.mfile)
+        
+    def testIOStats(self):
+        '''Test stages, per-array measurements, and file store hits are recorded when reading and writing.'''
+        dat=np.random.rand(30,20).astype(np.float32)
+        arrs=[array('gz',format=BASE64_GZ,data=dat),array('b1',format=BINARY,filename=self.dfile,data=dat)]
+        arrs.append(array('b2',format=BINARY,filename=self.dfile,data=dat))
+        
+        wstats=IOStats()
+        writeFile(dataset(None,None,arrs),self.mfile,stats=wstats)
+        
+        self.assertIn('compress',wstats.stages)
+        self.assertIn('write',wstats.stages)
+        self.assertEqual(['gz','b1','b2'],list(wstats.arrays))
+        
+        rstats=IOStats()
+        ds=readFile(self.mfile,stats=rstats)
+        
+        self.assertTrue(np.all(ds.getData('b2')==dat))
+        for stage in ('parse','fileread','decompress','base64'):
+            self.assertIn(stage,rstats.stages)
+            
+        self.assertIn('decompress',rstats.arrays['gz'])
+        self.assertIn('fileread',rstats.arrays['b1'])
+        self.assertEqual((1,1),(rstats.cacheMisses,rstats.cacheHits)) # data file is shared by both binary arrays
+        self.assertEqual({'hits':0,'misses':1},rstats.arrays['b1']['cache'])
+        self.assertEqual({'hits':1,'misses':0},rstats.asDict()['arrays']['b2']['cache'])
+        self.assertIn('parse',rstats.summary())
+        
+    def testFileCache(self):
+        '''Test a FileCache shared between reads reuses unchanged data files, reloads changed ones, and evicts by size.'''
+        dfile2=self.dfile+'2'
+        dat=np.random.rand(30,20).astype(np.float32)
+        arrs=[array('a1',format=BINARY,filename=self.dfile,data=dat),array('a2',format=BINARY,filename=dfile2,data=dat)]
+        writeFile(dataset(None,None,arrs),self.mfile)
+        
+        cache=FileCache()
+        stats=IOStats()
+        readFile(self.mfile,filestore=cache)
+        ds=readFile(self.mfile,filestore=cache,stats=stats)
+        
+        self.assertTrue(np.all(ds.getData('a1')==dat))
+        self.assertEqual((2,0),(stats.cacheHits,stats.cacheMisses))
+        self.assertEqual(2*dat.nbytes,cache.nbytes)
+        
+        dat2=np.random.rand(10,20).astype(np.float32)
+        arrs[0]=array('a1',format=BINARY,filename=self.dfile,data=dat2)
+        writeFile(dataset(None,None,arrs[:1]),self.mfile)
+        ds=readFile(self.mfile,filestore=cache)
+        
+        self.assertTrue(np.all(ds.getData('a1')==dat2))
+        self.assertEqual(dat.nbytes+dat2.nbytes,cache.nbytes) # the stale contents are discarded
+        
+        cache=FileCache(dat.nbytes)
+        writeFile(dataset(None,None,arrs),self.mfile)
+        readFile(self.mfile,filestore=cache)
+        
+        self.assertEqual(dat.nbytes,cache.nbytes)
+        self.assertNotIn(self.dfile,cache)
+        self.assertIn(dfile2,cache)
+        
+    def testFileCacheOversized(self):
+        '''Test a data file larger than a FileCache's budget is still read only once by each readFile() call.'''
+        dat=np.random.rand(30,20).astype(np.float32)
+        arrs=[array('a%i'%i,format=BINARY,filename=self.dfile+'.gz',data=dat) for i in range(4)]
+        writeFile(dataset(None,None,arrs),self.mfile)
+        
+        cache=FileCache(dat.nbytes)
+        for i in range(3):
+            stats=IOStats()
+            ds=readFile(self.mfile,filestore=cache,stats=stats)
+            
+            self.assertTrue(np.all(ds.getData('a3')==dat))
+            self.assertEqual((1,3),(stats.cacheMisses,stats.cacheHits))
+            self.assertEqual(0,cache.nbytes)
+            
+        # only the last file read is kept beyond the budget, so a file is read again after another is read
+        arrs=[array(n,format=BINARY,filename=f,data=dat) for n,f in (('a','d1.gz'),('b','d2.gz'),('c','d1.gz'))]
+        writeFile(dataset(None,None,arrs),self.ifile)
+        stats=IOStats()
+        ds=readFile(self.ifile,filestore=cache,stats=stats)
+        
+        self.assertTrue(np.all(ds.getData('c')==dat))
+        self.assertEqual((3,0),(stats.cacheMisses,stats.cacheHits))
+        
+    def testAppendToFile(self):
+        '''Test appending timesteps of an image series to an existing document and its data files.'''
+        gzfile=self.dfile+'.gz'
+        frames=[np.random.rand(4,5,6).astype(np.float32) for i in range(4)]
+        arrs=[array('frame0',format=BINARY,filename=self.dfile,data=frames[0])]
+        arrs.append(array('frame1',format=BINARY_GZ,filename=gzfile,data=frames[1]))
+        img=image('series',(0,1),None,[imagedata('frame0',0),imagedata('frame1',1)])
+        writeFile(dataset(None,[img],arrs),self.ifile)
+        
+        for i in (2,3):
+            arrs=[array('frame%i'%i,format=BINARY if i==2 else BINARY_GZ,filename=self.dfile if i==2 else gzfile,data=frames[i])]
+            appendToFile(dataset(None,[image('series',None,None,[imagedata('frame%i'%i,i)])],arrs),self.ifile)
+            
+        ds=readFile(self.ifile)
+        
+        self.assertEqual(1,len(ds.images))
+        self.assertEqual(['frame%i'%i for i in range(4)],[imd.src for imd in ds.images[0].imagedata])
+        self.assertEqual(2*frames[0].nbytes,os.path.getsize(self.dfile)) # existing data is kept in place
+        
+        for i,frame in enumerate(frames):
+            self.assertTrue(np.all(ds.getData('frame%i'%i)==frame))
+            
+        with self.assertRaises(ValueError):
+            appendToFile(dataset(None,None,[array('frame0',format=BINARY,filename=self.dfile,data=frames[0])]),self.ifile)
+            
+    def testAppendAfterOrphanedData(self):
+        '''Test appending places data after data left in files by an append which failed before updating the document.'''
+        gzfile=self.dfile+'.gz'
+        txtfile=self.tempfile('d.txt')
+        dat=np.random.rand(3,4).astype(np.float32)
+        writeFile(dataset(None,None,[array('a',format=BINARY_GZ,filename=gzfile,data=dat),array('t',filename=txtfile,data=dat)]),self.mfile)
+        
+        with gzip.open(gzfile,'ab') as o: # orphaned data from an append that failed
+            o.write(b'\xff'*100)
+            
+        with open(txtfile,'a') as o:
+            o.write('9 9 9 9\n')
+            
+        appendToFile(dataset(None,None,[array('b',format=BINARY_GZ,filename=gzfile,data=dat*2),array('u',filename=txtfile,data=dat*3)]),self.mfile)
+        ds=readFile(self.mfile)
+        
+        self.assertTrue(np.all(ds.getData('a')==dat))
+        self.assertTrue(np.all(ds.getData('b')==dat*2))
+        self.assertTrue(np.allclose(ds.getData('u'),dat*3))
+        
+    def testAppendKeepsElements(self):
+        '''Test appending copies existing array elements unchanged, including attributes not in array records.'''
+        csvfile=self.tempfile('d.txt')
+        with open(csvfile,'w') as o:
+            o.write('1,2,3\n4,5,6\n')
+            
+        with open(self.mfile,'w') as o:
+            o.write('<x4df>\n <array name="csv" filename="d.txt" sep=","/>\n <array name="inline">1 2\n3 4</array>\n</x4df>\n')
+            
+        appendToFile(dataset(None,None,[array('new',type='int32',filename='d2.txt',data=np.asarray([[7,8,9]]))]),self.mfile)
+        ds=readFile(self.mfile)
+        
+        self.assertTrue(np.all(ds.getData('csv')==[[1,2,3],[4,5,6]]))
+        self.assertTrue(np.all(ds.getData('new')==[7,8,9]))
+        
+        with open(self.mfile) as o:
+            self.assertIn('<array name="inline">1 2\n3 4</array>',o.read())
+        
+    def testStreamingWriter(self):
+        '''Test writing arrays from generators of chunks with X4DFWriter and reading them back.'''
+        frames=[np.random.rand(3,4,5).astype(np.float32) for i in range(5)]
+        inds=np.random.randint(0,100,(20,3))
+        
+        with X4DFWriter(self.ifile) as w:
+            w.addArray('series',(f[None] for f in frames),format_=BINARY_GZ,filename=self.dfile+'.gz')
+            w.addArray('frame0',frames[0],format_=BINARY,filename=self.dfile)
+            
+            with self.assertRaises(ValueError): # mismatched chunks, the data written to the file is left unused
+                w.addArray('bad',[np.zeros((2,3)),np.zeros((2,4))],format_=BINARY,filename=self.dfile)
+                
+            for fname in (self.dfile,None): # wrong shape in a file or inline
+                with self.assertRaises(ValueError):
+                    w.addArray('bad',frames[0],shape='4 4 5',format_=BASE64,filename=fname)
+                
+            w.addArray('frame1',[frames[1][:1],frames[1][1:]],format_=BINARY,filename=self.dfile)
+            w.addArray('inds',(inds[i:i+5] for i in range(0,20,5)),type_='int32',filename=self.dfile+'.txt')
+            w.addArray('inline',iter(frames),shape='15 4 5',format_=BASE64_GZ)
+            w.addImage(image('img',None,None,[imagedata('frame0',0),imagedata('frame1',1)]))
+            
+            with self.assertRaises(ValueError):
+                w.addArray('shuffled',frames,format_='binary_shuffle_gz',filename=self.dfile)
+            
+        ds=readFile(self.ifile)
+        
+        self.assertTrue(np.all(ds.getData('series')==np.stack(frames)))
+        self.assertTrue(np.all(ds.getData('frame1')==frames[1]))
+        self.assertTrue(np.all(ds.getData('inds')==inds))
+        self.assertNotIn('bad',[a.name for a in ds.arrays])
+        self.assertTrue(np.all(ds.getData('inline')==np.concatenate(frames)))
+        self.assertEqual(['frame0','frame1'],[imd.src for imd in ds.images[0].imagedata])
+        
+    def testAsyncReadWrite(self):
+        '''Test the asynchronous read and write coroutines, lazy loading, and streaming array bytes.'''
+        dat=np.random.rand(40,30).astype(np.float32)
+        arrs=[array('bin',format=BINARY,filename=self.dfile,data=dat),array('gz',format=BINARY,filename=self.dfile+'.gz',data=dat)]
+        arrs.append(array('inline',format=BASE64_GZ,data=dat))
+        
+        async def _test():
+            await awriteFile(dataset(None,None,arrs),self.mfile)
+            ds=await areadFile(self.mfile,lazy=True)
+            
+            self.assertTrue(np.all((await ds.arrays[2].data.aload())==dat))
+            
+            for arr in ds.arrays:
+                chunks=[c async for c in astreamArray(arr,self.tempdir,chunksize=1000)]
+                self.assertEqual(dat.tobytes(),b''.join(chunks))
+                
+            # unloaded lazy binary arrays are streamed directly from the files
+            self.assertEqual([False,False],[a.data.loaded for a in ds.arrays[:2]])
+                
+            ds.arrays[0].data=None # as are arrays without data
+            ds.arrays[1].data=None
+            chunks=[c async for c in astreamArray(ds.arrays[0],self.tempdir,chunksize=1000)]
+            gzchunks=[c async for c in astreamArray(ds.arrays[1],self.tempdir)]
+            
+            self.assertEqual(dat.nbytes//1000+1,len(chunks))
+            self.assertEqual(dat.tobytes(),b''.join(chunks))
+            self.assertEqual(dat.tobytes(),b''.join(gzchunks))
+            
+        asyncio.run(_test())
+        
+    def testScanFile(self):
+        '''Test scanning documents reads their structure without array data, individually and by directory.'''
+        writeFile(self.trimesh,self.mfile)
+        dat=np.random.rand(20,10).astype(np.float32)
+        arrs=[array('inline',format=BASE64_GZ,data=dat),array('bin',format=BINARY,filename=self.dfile,data=dat)]
+        writeFile(dataset(None,None,arrs,[meta('desc','scan test')]),self.ifile)
+        
+        ds=readFile(self.mfile)
+        sds=scanFile(self.mfile)
+        
+        self.assertEqual(ds.meshes,sds.meshes)
+        self.assertEqual([a.name for a in ds.arrays],[a.name for a in sds.arrays])
+        self.assertTrue(all(a.data is None for a in sds.arrays))
+        
+        with open(self.tempfile('bad.x4df'),'w') as o:
+            o.write('<x4df><array')
+            
+        scans=scanDirectory(self.tempdir,workers=2)
+        
+        self.assertEqual(sorted([self.mfile,self.ifile,self.tempfile('bad.x4df')]),list(scans))
+        self.assertIsInstance(scans[self.tempfile('bad.x4df')],Exception)
+        self.assertEqual([dat.nbytes]*2,[getArrayNbytes(a) for a in scans[self.ifile].arrays])
+        self.assertEqual('scan test',scans[self.ifile].metas[0].val)
+        
+    def testSharedTextFile(self):
+        '''Test many ascii arrays stored in one text file are read correctly with the file read and indexed once.'''
+        dats=[np.random.randint(0,100,(i%4+1,3)) for i in range(20)]
+        arrs=[array('a%i'%i,type='int32',filename=self.dfile+'.txt',data=d) for i,d in enumerate(dats)]
+        writeFile(dataset(None,None,arrs),self.mfile)
+        
+        stats=IOStats()
+        ds=readFile(self.mfile,stats=stats)
+        
+        for arr,dat in zip(ds.arrays,dats):
+            self.assertTrue(np.all(arr.data.reshape(dat.shape)==dat))
+            
+        self.assertEqual((1,19),(stats.cacheMisses,stats.cacheHits))
+        
     def testFileRead1(self):
         '''Tests reading from testdata files.'''    
         for f in glob.glob(os.path.join(testdir,'*.x4df')):
@@ -24,16 +24,21 @@ This module implements the X4DF IO routines and simple data structures. This is
 all that's necessary to read and write X4DF files. The two important functions
 for the user are:
 
-readFile(obj_or_path):
-    Read a X4DF file and return its data structure. The single argument
+readFile(obj_or_path,lazy=False,mmap=False,workers=None,processes=False,gzindex=False):
+    Read a X4DF file and return its data structure. The first argument
     is either a path to a file, a string containing the file data, or
     a file-like object which can be read to create the data structure.
+    If `lazy' is True array data is only read when first accessed, if
+    `mmap' is True uncompressed binary array files are memory-mapped.
+    Arrays are decoded concurrently by `workers' threads or processes.
+    If `gzindex' is True arrays are read from .gz files using an index.
 
-writeFile(obj,obj_or_path,overwriteFiles=True):
+writeFile(obj,obj_or_path,overwriteFiles=True,workers=None,processes=False,blocksize=None):
     Write the data structure `obj' to `obj_or_path' which is either a
     path to a file or a file-like object the data is to be written into.
     If `overwriteFiles' is True then array files will be overwritten if
-    necessary, otherwise array files are left untouched.
+    necessary, otherwise array files are left untouched. Arrays are
+    encoded concurrently by `workers' threads or processes.
 
 The data structure readFile() returns and writeFile() accepts is defined
 by a set of record types with these mutable members:
@@ -58,6 +63,46 @@ the value for that attribute/element, with the exception of "timescheme" which
 is a tuple of 2 numbers (start, step) and the members of "transform" which are
 numpy arrays representing 3-vectors or a 3x3 matrix.
 
+Arrays in a dataset can be looked up by name in constant time with the
+getArray() and getData() methods of dataset. The mesh methods getNodes(),
+getTopologies() and getFields(), and the image method getImageData(), return
+the data of the arrays their members refer to by name. The MeshTimes and
+ImageTimes classes index the nodes, fields, and image data by time, resolving
+timescheme and timestep definitions, so that the data at a time can be found.
+The transform methods toWorld(), toImage(), voxelsToWorld(), worldToVoxels()
+and voxelGrid() map arrays of points between image and world space.
+
+Parts of large binary arrays in files can be read without reading the whole
+array with readArraySlice(), or by indexing the LazyArray objects readFile()
+creates with lazy=True, eg. "ds.getData('image')[t,z0:z1]".
+
+The time spent in each stage of reading or writing, such as parsing, file reading,
+decompression and decoding, can be measured by passing an IOStats object as the
+`stats' argument of readFile() or writeFile(), eg. "print(stats.summary())".
+
+Data files can be cached between readFile() calls by passing a FileCache object
+as the `filestore' argument, this keeps the least recently used files up to a
+size limit and reloads files which have changed. Memory use is then bounded by
+this limit plus the size of the file most recently read, at the cost of reading
+a file again if it's evicted or too large for the cache and its arrays aren't
+consecutive in the document.
+
+Documents too large to hold in memory can be written with X4DFWriter, whose
+addArray() method writes an array's data from an iterable of chunks, eg. a
+generator producing each timestep's data as it's computed.
+
+The structure of a document can be read without any array data using
+scanFile(), and a directory tree of documents scanned with scanDirectory().
+
+For asyncio applications, the coroutines areadFile() and awriteFile(), and the
+aload() method of LazyArray, run reading and writing in an executor so as not to
+block the event loop, and astreamArray() yields the bytes of an array in chunks
+read as needed, eg. to send in a response.
+
+New arrays, mesh and image members can be added to an existing document with
+appendToFile(), which appends the new data to data files and rewrites only the
+XML document, eg. to add each new timestep of a series as it's acquired.
+
 For example, "readFile('foo.x4df')" will return a dataset instance whose `meshes'
 contains a list of mesh instances, an `images' member containing a list of
 `image' instance, an `arrays' member containing a list of `array' instances,
@@ -85,9 +130,22 @@ import os
 import sys
 import base64
 import gzip
+import zlib
+import bisect
 import contextlib
+import threading
+import itertools
+import functools
+import time
+import copy
+import weakref
+import asyncio
+import fnmatch
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Executor, Future
 
 import numpy as np
+from numpy.lib.mixins import NDArrayOperatorsMixin
 
 from io import StringIO,BytesIO
 
@@ -95,53 +153,604 @@ from io import StringIO,BytesIO
 ### Types and Definitions
 
 
-#TODO: read_csv is too picky with blank space if ' ' is the separator
-# attempt to define a text reading routine using pandas, defaulting to np.loadtxt if not available
-#try:
-#    from pandas import read_csv
-#    
-#    def readText(source,dtype,offset,sep):
-#        arr=read_csv(source,sep=sep or ' ',dtype=dtype,header=None,engine='c',skiprows=offset,lineterminator='\n',memory_map=True)
-#        return np.asarray(arr)
-#    
-#except ImportError:
-#    import warnings
-#    warnings.warn('Pandas not found, text data load will be slow.')
+def getTokenStarts(text):
+    '''Returns an array of the positions in bytes `text' where each whitespace-separated token starts.'''
+    b=np.frombuffer(text,np.uint8)
+    space=(b==32)|((b>=9)&(b<=13)) # space, tab, newline, vertical tab, form feed, carriage return
+    return np.flatnonzero(~space&np.concatenate(([True],space[:-1])))
+
+
+# lookup table of the bytes which can occur in text arrays, whitespace and the characters of numbers including inf and nan
+TEXTBYTES=np.zeros((256,),bool)
+TEXTBYTES[np.frombuffer(b' \t\n\v\f\r0123456789+-.eEinfatyINFATY',np.uint8)]=True
+
+
+def parseText(text,dtype,sep=None,shape=None):
+    '''
+    Parse the str or bytes value `text' containing numbers separated by whitespace, or by `sep' if given, into an array
+    of type `dtype'. The values are parsed in bulk by numpy, if `shape' is given exactly that many values are read and 
+    the result has that shape, otherwise the shape is inferred from the number of values on the first line such that
+    the result is the same as given by np.loadtxt. Text containing comments is parsed with np.loadtxt. A ValueError is
+    raised if the text contains values which can't be parsed, too few values for `shape', or if `shape' isn't given 
+    and the lines don't have the same number of values.
+    '''
+    isbytes=isinstance(text,bytes)
+    dtype=np.dtype(dtype)
+    
+    if (b'#' if isbytes else u'#') in text:
+        return np.loadtxt(BytesIO(text) if isbytes else StringIO(text),dtype,delimiter=sep)
+    
+    text=text if isbytes else text.encode('utf-8')
+    
+    if sep and sep.strip(): # replace non-whitespace separators, whitespace matches any whitespace including newlines
+        text=text.replace(np.compat.asbytes(sep),b' ')
+        
+    starts=getTokenStarts(text)
+    count=len(starts) if shape is None else int(np.prod(shape))
+    
+    if count>len(starts):
+        raise ValueError('Text array has %i values but %i are needed for shape %r'%(len(starts),count,tuple(shape)))
+    elif count<len(starts):
+        text=text[:starts[count]] # values following those needed aren't part of the array
+        
+    arr=None
+    if np.all(TEXTBYTES[np.frombuffer(text,np.uint8)]): # reject text with characters that can't be numbers up front
+        try:
+            arr=np.fromstring(text,dtype.newbyteorder('='),-1,' ') if count else np.zeros((0,),dtype.newbyteorder('='))
+        except (ValueError,DeprecationWarning): # numpy warns and will raise for malformed values rather than stop
+            pass
     
-def readText(source,dtype,offset,sep):
-    return np.loadtxt(source,dtype,skiprows=offset,delimiter=sep)
+    if arr is None or arr.shape[0]!=count: # older numpy stops parsing at the first value which isn't a number
+        raise ValueError('Text array contains values which could not be parsed as %s'%dtype)
+    
+    if arr.dtype!=dtype:
+        arr=arr.astype(dtype)
+    
+    if shape is not None:
+        return arr.reshape(shape)
+    elif count==0:
+        return arr
+    
+    # infer the 2D shape from the number of values on each non-blank line then remove dimensions of length 1 as 
+    # np.loadtxt does, every line must have the same number of values
+    linecounts=np.bincount(np.searchsorted(np.flatnonzero(np.frombuffer(text,np.uint8)==10),starts))
+    linecounts=linecounts[linecounts>0]
+    cols=linecounts[0]
+    
+    if np.any(linecounts!=cols):
+        raise ValueError('Text array rows do not have the same number of values')
+    
+    return np.squeeze(arr.reshape((count//cols,cols)))
     
 
+def getLineStarts(text):
+    '''Returns an array of the positions in bytes `text' following each newline, ie. the start of each line but the first.'''
+    return np.flatnonzero(np.frombuffer(text,np.uint8)==ord('\n'))+1
+
+
+def readText(source,dtype,offset,sep,shape=None,size=None,stats=None,filestore=None):
+    '''
+    Read text array data from `source', either a file path or a file-like object, into an array of type `dtype'. Reading
+    starts at line `offset' and reads `size' lines if given, otherwise to the end of the source. Values are separated by
+    whitespace or `sep' if given, and parsed with parseText() using `shape' if given. Files ending in .gz are decompressed.
+    If `stats' is an IOStats object reading files is timed as the "fileread" stage and parsing as the "text" stage.
+    
+    Lines are located with an index of the positions of every line start. If `filestore' is given the contents of a 
+    file and its index are stored in it, so that reading multiple arrays from one file reads and indexes it only once.
+    '''
+    if isinstance(source,str) and filestore is not None:
+        text=loadFileData(source,filestore,None,stats)
+        linestarts=loadFileData(('linestarts',source),filestore,lambda:getLineStarts(text))
+    else:
+        if isinstance(source,str):
+            with statsTimer(stats,'fileread'):
+                text=readFileContents(source)
+        else:
+            text=source.read()
+            text=text.encode('utf-8') if isinstance(text,str) else text
+            
+        linestarts=getLineStarts(text)
+        
+    offset=int(offset or 0)
+    start=0 if offset==0 else (int(linestarts[offset-1]) if offset<=len(linestarts) else len(text))
+    end=len(text)
+    
+    if size is not None:
+        last=offset+int(size) # index of the line following the last read
+        end=start if last==offset else (int(linestarts[last-1]) if last<=len(linestarts) else len(text))
+            
+    with statsTimer(stats,'text',end-start):
+        return parseText(text[start:end],dtype,sep,shape)
+    
+
+def recordEq(a,b):
+    '''
+    Returns True if record member values `a' and `b' are equal, comparing arrays and array-like objects such as 
+    LazyArray by shape and contents.
+    '''
+    if a is b:
+        return True
+    elif hasattr(a,'__array__') or hasattr(b,'__array__'):
+        return np.array_equal(a,b)
+    else:
+        return a==b
+        
+
 def namedrecord(name,members):
-    '''Returns a type with the given name and members like namedtuple but mutable and less efficient.'''
-    members=[m.strip() for m in members.split(',' if ',' in members else None)]
+    '''
+    Returns a type with the given name and members like namedtuple but mutable. Instances store their members in slots
+    rather than a dictionary and are initialized by a generated constructor whose arguments default to None. Instances 
+    compare equal if they are of the same type and their members are equal, and can be pickled. Hashing is by identity
+    so that records can be used in sets and as dictionary keys, thus equal records needn't have equal hashes.
+    '''
+    members=tuple(m.strip() for m in members.split(',' if ',' in members else None))
 
-    def _init(obj,*values,**kwvalues):
-        for name,value in list(zip(members,values))+list(kwvalues.items()):
-            setattr(obj,name,value)
+    # generate the constructor source so that construction is a series of direct slot assignments
+    args=''.join(', %s=None'%m for m in members)
+    body=''.join('\n    self.%s=%s'%(m,m) for m in members)
+    namespace={}
+    exec('def __init__(self%s):%s'%(args,body),namespace)
 
     def _str(obj):
         attrs=', '.join('%s=%r'%(m,getattr(obj,m)) for m in members)
         return '%s(%s)'%(name,attrs)
-
-    tmembers={m:None for m in members}
-    tmembers['__init__']=_init
-    tmembers['__repr__']=_str
-    tmembers['__iter__']=lambda obj:(getattr(obj,m) for m in members)
+    
+    def _eq(obj,other):
+        return type(obj) is type(other) and all(recordEq(a,b) for a,b in zip(obj,other))
+        
+    def _ne(obj,other):
+        return not _eq(obj,other)
+
+    tmembers={
+        '__slots__':members,
+        '__init__':namespace['__init__'],
+        '__repr__':_str,
+        '__iter__':lambda obj:(getattr(obj,m) for m in members),
+        '__eq__':_eq,
+        '__ne__':_ne,
+        '__hash__':object.__hash__, # mutable so hashed by identity
+        '__reduce__':lambda obj:(type(obj),tuple(obj)),
+    }
 
     return type(name,(),tmembers)
 
 
-dataset=namedrecord('dataset','meshes images arrays metas')
+class ArrayList(list):
+    '''
+    List of array objects which maintains an index from names to arrays, this is used to look up arrays by name in 
+    constant time. The index is discarded whenever the list is modified and rebuilt when next needed. Arrays in the list
+    when the index is built record the list so that renaming them discards its index. If multiple arrays have the same 
+    name the first is found as with a linear search.
+    '''
+    __slots__=('nameindex','__weakref__')
+    
+    def __init__(self,*args):
+        list.__init__(self,*args)
+        self.nameindex=None
+        
+    def __reduce__(self):
+        return (ArrayList,(list(self),))
+        
+    def invalidateIndex(self):
+        self.nameindex=None
+        
+    def find(self,name):
+        '''Returns the first array named `name' or None if not present.'''
+        if self.nameindex is None:
+            nameindex={}
+            for a in self:
+                nameindex.setdefault(a.name,a)
+                if isinstance(a,array):
+                    a.addList(self)
+                    
+            self.nameindex=nameindex
+                
+        return self.nameindex.get(name)
+    
+    # list methods which modify the list discard the index
+    
+    def append(self,obj):
+        self.nameindex=None
+        list.append(self,obj)
+        
+    def extend(self,objs):
+        self.nameindex=None
+        list.extend(self,objs)
+        
+    def insert(self,index,obj):
+        self.nameindex=None
+        list.insert(self,index,obj)
+        
+    def remove(self,obj):
+        self.nameindex=None
+        list.remove(self,obj)
+        
+    def pop(self,index=-1):
+        self.nameindex=None
+        return list.pop(self,index)
+    
+    def sort(self,*args,**kwargs):
+        self.nameindex=None
+        list.sort(self,*args,**kwargs)
+        
+    def reverse(self):
+        self.nameindex=None
+        list.reverse(self)
+        
+    def clear(self):
+        self.nameindex=None
+        list.clear(self)
+        
+    def __setitem__(self,index,obj):
+        self.nameindex=None
+        list.__setitem__(self,index,obj)
+        
+    def __delitem__(self,index):
+        self.nameindex=None
+        list.__delitem__(self,index)
+        
+    def __iadd__(self,objs):
+        self.nameindex=None
+        return list.__iadd__(self,objs)
+    
+    def __imul__(self,num):
+        self.nameindex=None
+        return list.__imul__(self,num)
+    
+
+datasetrecord=namedrecord('dataset','meshes images arrays metas')
 meta=namedrecord('meta','name val text children')
 nodes=namedrecord('nodes','src initialnodes timestep metas')
 topology=namedrecord('topology','name src elemtype spatial metas')
 field=namedrecord('field','name src timestep topology spatial fieldtype metas')
 imagedata=namedrecord('imagedata','src timestep transform metas')
-mesh=namedrecord('mesh','name timescheme nodes topologies fields metas')
-image=namedrecord('image','name timescheme transform imagedata metas')
-transform=namedrecord('transform','position rmatrix scale')
-array=namedrecord('array','name shape dimorder type format offset size filename data')
+meshrecord=namedrecord('mesh','name timescheme nodes topologies fields metas')
+imagerecord=namedrecord('image','name timescheme transform imagedata metas')
+transformrecord=namedrecord('transform','position rmatrix scale')
+arrayrecord=namedrecord('array','name shape dimorder type format offset size filename data')
+
+
+class dataset(datasetrecord):
+    '''
+    Dataset record with methods for looking up arrays by name. If the `arrays' member is an ArrayList, as it is for 
+    datasets returned by readFile(), arrays are found using its index, otherwise the list is searched. The list given
+    is stored as is, so use an ArrayList when constructing datasets with many arrays to look up.
+    '''
+    __slots__=()
+    
+    def getArray(self,name):
+        '''Returns the first array object named `name', raising KeyError if there is none.'''
+        if isinstance(self.arrays,ArrayList):
+            arr=self.arrays.find(name)
+        else:
+            arr=next((a for a in (self.arrays or []) if a.name==name),None)
+            
+        if arr is None:
+            raise KeyError('No array named %r'%name)
+            
+        return arr
+    
+    def getData(self,name):
+        '''Returns the data of the first array named `name', raising KeyError if there is none.'''
+        return self.getArray(name).data
+    
+    
+class array(arrayrecord):
+    '''Array record which discards the name indices of the ArrayList objects indexing it when it's renamed.'''
+    __slots__=('lists',) # weak references to the ArrayList objects whose index includes this array
+    
+    def getLists(self):
+        '''Returns the existing ArrayList objects which have indexed this array.'''
+        lists=[r() for r in getattr(self,'lists',())]
+        return [l for l in lists if l is not None]
+    
+    def addList(self,arraylist):
+        '''Record that ArrayList `arraylist' has indexed this array.'''
+        lists=self.getLists()
+        if not any(l is arraylist for l in lists):
+            self.lists=[weakref.ref(l) for l in lists+[arraylist]]
+    
+    @property
+    def name(self):
+        return arrayrecord.name.__get__(self)
+    
+    @name.setter
+    def name(self,name):
+        try:
+            if arrayrecord.name.__get__(self)!=name:
+                for arraylist in self.getLists():
+                    arraylist.invalidateIndex()
+        except AttributeError: # not yet set in the constructor
+            pass
+            
+        arrayrecord.name.__set__(self,name)
+        
+        
+class mesh(meshrecord):
+    '''Mesh record with methods for resolving its references to arrays in a dataset.'''
+    __slots__=()
+    
+    def getNodes(self,ds):
+        '''
+        Returns a list with the node data of each nodes object in `ds'. If a nodes object names an array of initial node 
+        positions then the data is the sum of these and the offsets stored in the nodes array.
+        '''
+        result=[]
+        for n in self.nodes or []:
+            dat=ds.getData(n.src)
+            if n.initialnodes:
+                dat=np.asarray(ds.getData(n.initialnodes))+np.asarray(dat)
+                
+            result.append(dat)
+            
+        return result
+    
+    def getTopologies(self,ds):
+        '''Returns an OrderedDict mapping the name of each topology to its data in `ds'.'''
+        return OrderedDict((t.name,ds.getData(t.src)) for t in self.topologies or [])
+    
+    def getFields(self,ds,name=None):
+        '''
+        Returns an OrderedDict mapping each field name to a list of the data in `ds' of the fields with that name in
+        document order. If `name' is given only the list for that field name is returned.
+        '''
+        result=OrderedDict()
+        for f in self.fields or []:
+            if name is None or f.name==name:
+                result.setdefault(f.name,[]).append(ds.getData(f.src))
+                
+        return result if name is None else result.get(name,[])
+    
+    
+class image(imagerecord):
+    '''Image record with methods for resolving its references to arrays in a dataset.'''
+    __slots__=()
+    
+    def getImageData(self,ds):
+        '''Returns a list with the data in `ds' of each imagedata object.'''
+        return [ds.getData(i.src) for i in self.imagedata or []]
+    
+    def getTransform(self,imd):
+        '''Returns the transform for imagedata `imd', which is its own, this image's, or idTransform if neither is given.'''
+        return imd.transform or self.transform or idTransform
+    
+
+class transform(transformrecord):
+    '''
+    Transform record with methods for mapping between image and world space using the 4x4 matrix defined in the README.
+    Image space is the unit cube the transform maps to world space, a voxel index `i' in a dimension of size `n' is at
+    position `i/n' in image space which is the voxel's minimal corner. All methods operate on arrays of points or 
+    indices whose last dimension has size 3 using vectorized operations. The matrix and its inverse are cached and 
+    recomputed if the members change, the inverse is only computed when needed since the matrix may be singular, eg. 
+    for a 2D image plane with a zero scale component, in which case numpy.linalg.LinAlgError is raised.
+    '''
+    __slots__=('matrixcache',)
+    
+    def getMatrixCache(self):
+        '''Returns the cache list [key,matrix,inverse or None], replacing it with a new one if the members have changed.'''
+        pos=np.asarray(self.position if self.position is not None else idTransform.position,float)
+        rmat=np.asarray(self.rmatrix if self.rmatrix is not None else idTransform.rmatrix,float)
+        scale=np.asarray(self.scale if self.scale is not None else idTransform.scale,float)
+        key=(pos.tobytes(),rmat.tobytes(),scale.tobytes())
+        cache=getattr(self,'matrixcache',None)
+        
+        if cache is None or cache[0]!=key:
+            mat=np.eye(4)
+            mat[:3,:3]=rmat.reshape((3,3))*scale.reshape((1,3))
+            mat[:3,3]=pos.reshape(3)
+            cache=self.matrixcache=[key,mat,None]
+            
+        return cache
+    
+    def getMatrices(self):
+        '''Returns the 4x4 transform matrix and its inverse.'''
+        return self.getMatrix(),self.getInverse()
+    
+    def getMatrix(self):
+        '''Returns the 4x4 matrix transforming image space to world space.'''
+        return self.getMatrixCache()[1]
+    
+    def getInverse(self):
+        '''Returns the 4x4 matrix transforming world space to image space.'''
+        cache=self.getMatrixCache()
+        if cache[2] is None:
+            cache[2]=np.linalg.inv(cache[1])
+            
+        return cache[2]
+    
+    def toWorld(self,points):
+        '''Transform the image space points `points' to world space.'''
+        mat=self.getMatrix()
+        return np.dot(points,mat[:3,:3].T)+mat[:3,3]
+    
+    def toImage(self,points):
+        '''Transform the world space points `points' to image space.'''
+        inv=self.getInverse()
+        return np.dot(points,inv[:3,:3].T)+inv[:3,3]
+    
+    def voxelsToWorld(self,indices,dims):
+        '''Transform the voxel indices `indices' of an image with dimensions `dims' to world space.'''
+        return self.toWorld(np.asarray(indices,float)/np.asarray(dims,float)[:3])
+    
+    def worldToVoxels(self,points,dims):
+        '''
+        Transform the world space points `points' to fractional voxel indices of an image with dimensions `dims', these 
+        can be converted to the indices of the voxels containing the points with np.floor.
+        '''
+        return self.toImage(points)*np.asarray(dims,float)[:3]
+    
+    def voxelGrid(self,dims):
+        '''
+        Returns an array of shape (X,Y,Z,3) giving the world space position of every voxel of an image with dimensions
+        `dims', which are the first 3 dimensions of the image, ie. X, Y, and Z.
+        '''
+        mat=self.getMatrix()
+        dims=tuple(int(d) for d in dims[:3])
+        grid=np.empty(dims+(3,))
+        grid[...]=mat[:3,3]
+        
+        # add the contribution of each axis by broadcasting its positions along that axis
+        for axis,dim in enumerate(dims):
+            vals=np.arange(dim)[:,None]*(mat[:3,axis]/dim)
+            grid+=vals.reshape((1,)*axis+(dim,)+(1,)*(2-axis)+(3,))
+            
+        return grid
+
+
+class TimeIndex(object):
+    '''
+    Sorted index of the times of a list of nodes, field, or imagedata objects. If `timescheme' is given as a (start,step)
+    pair the objects are assigned times in list order starting at `start' and incrementing by `step', otherwise each 
+    object's `timestep' member gives its time, or its position in the list if this is None. Objects with equal times
+    stay in list order. Looking up the object at a time is done with a binary search so takes O(log n) time.
+    '''
+    def __init__(self,objs,timescheme=None):
+        start,step=map(float,timescheme or (0,1))
+        
+        times=[]
+        for i,obj in enumerate(objs):
+            if timescheme is None and obj.timestep is not None:
+                times.append(float(obj.timestep))
+            else:
+                times.append(start+i*step)
+            
+        order=sorted(range(len(times)),key=times.__getitem__)
+        self.times=[times[i] for i in order]
+        self.objs=[objs[i] for i in order]
+        
+    def __len__(self):
+        return len(self.objs)
+    
+    def indexAt(self,t):
+        '''Returns the index of the last object at or before time `t', or of the first object if `t' precedes it.'''
+        return max(0,bisect.bisect_right(self.times,t)-1)
+        
+    def objAt(self,t):
+        '''Returns the object defined at or most recently before time `t'.'''
+        return self.objs[self.indexAt(t)]
+        
+    def neighbours(self,t):
+        '''
+        Returns the indices (i,j) of the objects defined at or before and after time `t' and the interpolation value in
+        the range [0,1] of `t' between their times. If `t' is outside the range of times i and j are the first or last.
+        '''
+        i=self.indexAt(t)
+        j=min(i+1,len(self.times)-1)
+        
+        if i==j or t<=self.times[i]:
+            return i,i,0.0
+        
+        return i,j,(t-self.times[i])/(self.times[j]-self.times[i])
+            
+            
+class MeshTimes(object):
+    '''
+    Time index for a mesh `meshobj' from dataset `ds' used to look up its node and field data at given times. These are
+    resolved following the rules given in the README: node and field objects are ordered lists of timesteps if the mesh
+    has a timescheme, otherwise each has its own timestep, and a field with only one definition applies at every time.
+    The indices are built once when constructed and the mesh must not be modified while in use.
+    
+    Data is only retrieved from the dataset when requested, so if the dataset was read with lazy=True only the arrays 
+    for the requested times are loaded. Node data combined with initial node positions is cached once computed.
+    '''
+    def __init__(self,meshobj,ds):
+        self.mesh=meshobj
+        self.ds=ds
+        self.nodeIndex=TimeIndex(meshobj.nodes or [],meshobj.timescheme)
+        self.nodeCache={}
+        self.fieldIndices=OrderedDict()
+        
+        fields=OrderedDict()
+        for f in meshobj.fields or []:
+            fields.setdefault(f.name,[]).append(f)
+            
+        for name,flist in fields.items():
+            self.fieldIndices[name]=TimeIndex(flist,meshobj.timescheme)
+            
+    def getNodeData(self,i):
+        '''Returns the node data for the nodes object at index `i' in the node index.'''
+        if i not in self.nodeCache:
+            n=self.nodeIndex.objs[i]
+            dat=np.asarray(self.ds.getData(n.src))
+            if n.initialnodes:
+                dat=np.asarray(self.ds.getData(n.initialnodes))+dat
+                
+            self.nodeCache[i]=dat
+            
+        return self.nodeCache[i]
+    
+    def nodesAt(self,t):
+        '''Returns the node data defined at or most recently before time `t'.'''
+        return self.getNodeData(self.nodeIndex.indexAt(t))
+    
+    def fieldAt(self,name,t):
+        '''Returns the data of field `name' defined at or most recently before time `t'.'''
+        return np.asarray(self.ds.getData(self.fieldIndices[name].objAt(t).src))
+    
+    def nodesNeighbours(self,t):
+        '''
+        Returns the node data defined before and after time `t' and the interpolation value between them, so that the
+        interpolated nodes are `n1+(n2-n1)*v' for returned values (n1,n2,v).
+        '''
+        i,j,v=self.nodeIndex.neighbours(t)
+        return self.getNodeData(i),self.getNodeData(j),v
+    
+    def fieldNeighbours(self,name,t):
+        '''Returns the data of field `name' defined before and after time `t' and the interpolation value between them.'''
+        index=self.fieldIndices[name]
+        i,j,v=index.neighbours(t)
+        return np.asarray(self.ds.getData(index.objs[i].src)),np.asarray(self.ds.getData(index.objs[j].src)),v
+    
+    
+class ImageTimes(object):
+    '''
+    Time index for an image `imageobj' from dataset `ds' used to look up its imagedata objects and their data at given 
+    times. These are resolved following the rules given in the README: if there are multiple imagedata objects the 
+    timescheme is ignored and each is placed in time by its timestep, or its position in the list if this is None. If 
+    there is a single imagedata object and a timescheme, the timescheme gives the times of the frames along the time 
+    dimension of its array, the 4th dimension, and the data at a time is that frame. Data is only retrieved from the 
+    dataset when requested as with MeshTimes. A frame spans the whole of an array's data in its file so a lazily read 
+    array is loaded when its first frame is requested, later frames are then taken from the loaded array.
+    '''
+    def __init__(self,imageobj,ds):
+        self.image=imageobj
+        self.ds=ds
+        self.index=TimeIndex(imageobj.imagedata or [])
+        self.frameIndex=None # index of the frames in the time dimension of a single imagedata array
+        
+        if len(self.index)==1 and imageobj.timescheme is not None:
+            arr=ds.getArray(self.index.objs[0].src)
+            shape=parseNumString(arr.shape,int) if arr.shape else np.shape(arr.data)
+            
+            if len(shape)>3:
+                self.frameIndex=TimeIndex(list(range(shape[3])),imageobj.timescheme)
+        
+    def imagedataAt(self,t):
+        '''Returns the imagedata object defined at or most recently before time `t'.'''
+        return self.index.objAt(t)
+    
+    def getFrame(self,dat,i):
+        '''Returns frame `i' of image data `dat' if the image has a frame index, otherwise `dat' itself.'''
+        if self.frameIndex is None:
+            return np.asarray(dat)
+        
+        return np.asarray(dat)[:,:,:,i] # loads a LazyArray once rather than reading the whole array for every frame
+    
+    def dataAt(self,t):
+        '''Returns the image data, or the frame of a single 4D image, defined at or most recently before time `t'.'''
+        dat=self.ds.getData(self.imagedataAt(t).src)
+        return self.getFrame(dat,self.frameIndex.objAt(t) if self.frameIndex is not None else None)
+    
+    def dataNeighbours(self,t):
+        '''Returns the image data or frames defined before and after time `t' and the interpolation value between them.'''
+        if self.frameIndex is not None:
+            dat=self.ds.getData(self.index.objs[0].src)
+            i,j,v=self.frameIndex.neighbours(t)
+            return self.getFrame(dat,i),self.getFrame(dat,j),v
+            
+        i,j,v=self.index.neighbours(t)
+        return np.asarray(self.ds.getData(self.index.objs[i].src)),np.asarray(self.ds.getData(self.index.objs[j].src)),v
+
 
 # valid array format names
 ASCII='ascii' # ascii text containing whitespace-separated numbers
@@ -149,9 +758,16 @@ BASE64='base64' # base64 encoding of array binary data
 BASE64_GZ='base64_gz' # base64 encoding of gzip compressed array binary data
 BINARY='binary' # array binary data
 BINARY_GZ='binary_gz' # gzip compressed array binary data
+BINARY_CHUNKED_GZ='binary_chunked_gz' # array binary data split into chunks of rows each gzip compressed independently
 
 # valid array formats
-validFormats=(ASCII, BASE64, BASE64_GZ, BINARY, BINARY_GZ)
+validFormats=(ASCII, BASE64, BASE64_GZ, BINARY, BINARY_GZ, BINARY_CHUNKED_GZ)
+
+# binary formats which must be stored in separate files, as must any other format isBinaryFormat() is True for
+binaryFormats=(BINARY, BINARY_GZ, BINARY_CHUNKED_GZ)
+
+# compression codecs by name, see registerCodec()
+codecRegistry=OrderedDict()
 
 # valid field type names
 NODE='node' # per node field
@@ -164,16 +780,105 @@ validFieldTypes=(NODE, ELEM, INDEX)
 # gzip compression level
 COMPRESS=6
 
-# base64 string line length, breaking base64 data into multiple lines is more readable
+# base64 string line length, breaking base64 data into multiple lines is more readable, must be a multiple of 4
 B64LINELEN=80
 
+# size in bytes of chunks used when encoding, decoding, or compressing data in stages
+CHUNKSIZE=1<<20
+
+# minimum size in bytes of the contiguous runs of a slice read individually, smaller runs are read as one span
+SLICERUNBYTES=1<<16
+
 # identity transform object
 idTransform=transform(np.array([0,0,0]),np.eye(3),np.array([1,1,1]))
 
 
+def registerCodec(name,compress,decompress,level,concatenated=False):
+    '''
+    Register a compression codec with the given name, which enables the formats `binary_<name>' and `base64_<name>', and 
+    the shuffled variants `binary_shuffle_<name>' and `base64_shuffle_<name>'. The `compress' callable accepts an 
+    iterable of byte chunks and a compression level and yields the compressed bytes, and `decompress' accepts an 
+    iterable of compressed byte chunks and yields the decompressed bytes. The `level' value is the default compression
+    level. If `concatenated' is True then `decompress' accepts consecutive compressed streams, as iterDecompressor() 
+    does, so that blocks of large arrays can be compressed concurrently by encodeArrayData(). The "gz" codec is gzip 
+    (RFC 1952) and is used by the original binary_gz and base64_gz formats.
+    '''
+    assert name and '_' not in name, 'Invalid codec name: %r'%name
+    codecRegistry[name]=(compress,decompress,level,concatenated)
+
+
+def iterCompressor(chunks,comp):
+    '''Yields the bytes produced by compressor object `comp' with compress() and flush() methods for `chunks'.'''
+    for chunk in chunks:
+        out=comp.compress(chunk)
+        if out:
+            yield out
+            
+    yield comp.flush()
+    
+
+def iterDecompressor(chunks,createDecomp):
+    '''
+    Yields the bytes produced by decompressor objects created by `createDecomp' for `chunks'. These must have a 
+    decompress() method and `eof' and `unused_data' members, a new decompressor is used for data following a completed
+    stream so that concatenated streams are decompressed.
+    '''
+    decomp=createDecomp()
+    
+    for chunk in chunks:
+        while chunk:
+            yield decomp.decompress(chunk)
+            
+            if decomp.eof: 
+                chunk=decomp.unused_data
+                decomp=createDecomp()
+            else:
+                chunk=None
+
+
+def parseFormat(format_):
+    '''
+    Returns the (base,shuffle,codec) triple for the format name `format_', where `base' is one of ASCII, BASE64, or 
+    BINARY, `shuffle' is True if the array bytes are shuffled before compressing, and `codec' is the name of the codec
+    in codecRegistry used to compress the data or None. A ValueError is raised if the format is not valid.
+    '''
+    if format_ in (None,ASCII):
+        return ASCII,False,None
+    
+    parts=str(format_).split('_')
+    base=parts[0]
+    shuffle=len(parts)==3 and parts[1]=='shuffle'
+    codec=parts[-1] if len(parts)>1 else None
+    
+    if format_==BINARY_CHUNKED_GZ:
+        return BINARY,False,'gz'
+    elif base not in (BASE64,BINARY) or len(parts)>3 or (len(parts)==3 and not shuffle) or (codec and codec not in codecRegistry):
+        raise ValueError('Invalid array format: %r'%format_)
+        
+    return base,shuffle,codec
+
+
+def isBinaryFormat(format_):
+    '''Returns True if `format_' is a valid binary format, including those using codecs, which must be stored in files.'''
+    return isValidFormat(format_) and parseFormat(format_)[0]==BINARY
+
+
+def isValidFormat(format_):
+    '''Returns True if `format_' is None, a member of validFormats, or a format using a registered codec.'''
+    try:
+        parseFormat(format_)
+        return True
+    except ValueError:
+        return False
+
+
 def isIDTransform(obj):
     '''Returns True if `obj' is a transform object equivalent to the identity.'''
-    return obj and np.all(obj.position==idTransform.position) and np.all(obj.scale==idTransform.scale) and np.all(obj.rmatrix==idTransform.rmatrix)
+    if obj is None:
+        return False
+    
+    members=zip((obj.position,obj.rmatrix,obj.scale),(idTransform.position,idTransform.rmatrix,idTransform.scale))
+    return all(m is None or np.array_equal(np.reshape(m,-1),np.reshape(i,-1)) for m,i in members)
 
 
 ### Reading XML Functions
@@ -277,57 +982,932 @@ def readImage(tree):
     return image(name,timescheme,transform_,imagedata,metas)
 
 
-def readArrayData(shape,dimorder,type_,format_,offset,size,fullfilename,sep,text,filestore):
-    '''Read the data for an array from the file `fullfilename' if given otherwise from the `text' string value.'''
-    assert not format_ or format_ in validFormats
+class IOStats(object):
+    '''
+    Collects the time spent and number of bytes processed in each stage of reading or writing a document, in total and
+    for each array, and the number of hits and misses when loading data files into the file store. Instances are passed 
+    as the `stats' argument to readFile() and writeFile(), and are thread-safe so that stages run by worker threads 
+    are included but not those run in worker processes. 
+    
+    The stages of reading are "parse" (XML parsing), "fileread" (reading data files), "decompress", "base64", "text" 
+    (parsing text data), "copy" (copying decoded data into arrays), "mmap", and "reshape". The stages of writing are 
+    "text" (formatting text data), "compress", "base64", and "write" (writing to files or the document). Times are 
+    exclusive so nested stages aren't counted twice, eg. time spent decompressing data being decoded from base64 is 
+    counted only in "decompress". Subclasses can override record() and recordCache() to observe measurements as they 
+    are made, eg. to send them to a monitoring service.
+    '''
+    def __init__(self):
+        self.lock=threading.Lock()
+        self.local=threading.local()
+        self.array=None # name of the array measurements are recorded for, set by forArray()
+        self.stages=OrderedDict() # stage name -> [count, seconds, bytes]
+        self.arrays=OrderedDict() # array name -> stage name -> [count, seconds, bytes], and 'cache' -> hit and miss counts
+        self.cache={'hits':0,'misses':0} # file store lookup counts
+        
+    @property
+    def cacheHits(self):
+        return self.cache['hits']
+    
+    @property
+    def cacheMisses(self):
+        return self.cache['misses']
+        
+    def forArray(self,name):
+        '''Returns a view of this object sharing its measurements which records them for the array named `name'.'''
+        view=copy.copy(self)
+        view.array=name
+        return view
+    
+    def record(self,stage,seconds,nbytes=0,array=None):
+        '''Record that `seconds' time was spent processing `nbytes' bytes in stage `stage' for array named `array'.'''
+        with self.lock:
+            totals=[self.stages.setdefault(stage,[0,0.0,0])]
+            if array is not None:
+                totals.append(self.arrays.setdefault(array,OrderedDict()).setdefault(stage,[0,0.0,0]))
+                
+            for t in totals:
+                t[0]+=1
+                t[1]+=seconds
+                t[2]+=nbytes
+            
+    def recordCache(self,key,hit,array=None):
+        '''Record whether the file store lookup for `key' for array named `array' was a hit.'''
+        counter='hits' if hit else 'misses'
+        with self.lock:
+            self.cache[counter]+=1
+            if array is not None:
+                self.arrays.setdefault(array,OrderedDict()).setdefault('cache',{'hits':0,'misses':0})[counter]+=1
+        
+    def startTimer(self):
+        '''Start timing a stage, nested timers started before stopTimer() is called are excluded from its time.'''
+        stack=self.local.__dict__.setdefault('stack',[])
+        stack.append(0.0)
+        return time.perf_counter()
+        
+    def stopTimer(self,start,stage,nbytes=0):
+        '''Stop timing the stage started at `start' and record it.'''
+        elapsed=time.perf_counter()-start
+        stack=self.local.stack
+        nested=stack.pop()
+        
+        if stack:
+            stack[-1]+=elapsed # exclude this time from the enclosing stage
+            
+        self.record(stage,elapsed-nested,nbytes,self.array)
+        
+    @contextlib.contextmanager
+    def timer(self,stage,nbytes=0):
+        '''Context manager timing the enclosed code as stage `stage' processing `nbytes' bytes.'''
+        start=self.startTimer()
+        try:
+            yield
+        finally:
+            self.stopTimer(start,stage,nbytes)
+        
+    def iterTimed(self,chunks,stage):
+        '''Yields each item of iterable `chunks' while timing the production of each as stage `stage'.'''
+        chunks=iter(chunks)
+        done=object() # marks the end of the chunks
+        
+        while True:
+            start=self.startTimer()
+            chunk=done
+            try:
+                chunk=next(chunks,done)
+            finally:
+                self.stopTimer(start,stage,len(chunk) if isinstance(chunk,(bytes,str,bytearray)) else getattr(chunk,'nbytes',0))
+                
+            if chunk is done:
+                return
+            
+            yield chunk
+            
+    def asDict(self):
+        '''Returns the collected measurements as a dictionary of plain values, eg. for conversion to JSON.'''
+        todict=lambda stages:OrderedDict((k,dict(v) if k=='cache' else dict(zip(('count','seconds','bytes'),v))) for k,v in stages.items())
+        
+        with self.lock:
+            return {
+                'stages':todict(self.stages),
+                'arrays':OrderedDict((name,todict(stages)) for name,stages in self.arrays.items()),
+                'cache':dict(self.cache),
+            }
+    
+    def summary(self):
+        '''Returns a text table of the total time and bytes of each stage and the file store hit and miss counts.'''
+        lines=['%-12s %8s %10s %12s'%('Stage','Count','Seconds','MB')]
+        with self.lock:
+            for stage,(count,seconds,nbytes) in self.stages.items():
+                lines.append('%-12s %8i %10.4f %12.3f'%(stage,count,seconds,nbytes/1e6))
+                
+            lines.append('File store hits: %i, misses: %i'%(self.cacheHits,self.cacheMisses))
+            
+        return '\n'.join(lines)
+    
+
+def statsTimer(stats,stage,nbytes=0):
+    '''Returns the context manager timing stage `stage' with IOStats object `stats', or one doing nothing if it's None.'''
+    return stats.timer(stage,nbytes) if stats is not None else contextlib.nullcontext()
+
+
+class FileStore(dict):
+    '''
+    Dictionary mapping file paths to their contents, used when reading a document to load each data file only once when
+    multiple arrays are stored in it. Other values derived from files, such as GzipIndex objects, are stored with tuple 
+    keys. The load() method is thread-safe so that concurrent requests for the same file wait on a single read. A 
+    FileStore sent to another process is received empty since its contents are only valid locally.
+    '''
+    def __init__(self):
+        dict.__init__(self)
+        self.lock=threading.Lock()
+        self.filelocks={}
+
+    def __reduce__(self):
+        return (FileStore,())
+
+    def load(self,key,loader=None):
+        '''
+        Returns the value stored for `key', loading it first if not already stored. If `loader' is None then `key' is a
+        file name whose contents are read, otherwise the value is loaded by calling `loader()'.
+        '''
+        with self.lock:
+            filelock=self.filelocks.setdefault(key,threading.Lock())
+
+        with filelock:
+            if key not in self:
+                self[key]=loader() if loader is not None else readFileContents(key)
+
+        return self[key]
+
+
+class FileCache(FileStore):
+    '''
+    File store which can be shared between readFile() calls and threads to avoid rereading data files used by multiple
+    documents or when a document is read repeatedly. Values are stored with the modification time and size of the file
+    they're derived from so that a changed file is reloaded, with the stale value then discarded. When the total size 
+    of stored values exceeds `maxbytes' the least recently used are evicted, values larger than `maxbytes' are loaded 
+    but not stored. The size of a value is the length of bytes values and its `nbytes' attribute otherwise, if present.
+    '''
+    def __init__(self,maxbytes=1<<30):
+        FileStore.__init__(self)
+        self.maxbytes=maxbytes
+        self.nbytes=0 # total size of stored values
+        self.recent=OrderedDict() # stored keys -> value sizes in least to most recently used order
+        self.current={} # keys passed to load() -> the stored key for the current version of the file
+
+    def __reduce__(self):
+        return (FileCache,(self.maxbytes,))
+    
+    def __contains__(self,key):
+        try:
+            return dict.__contains__(self,self.fileKey(key))
+        except OSError:
+            return False
+    
+    @staticmethod
+    def fileKey(key):
+        '''Returns the key values for `key' are stored with, which includes the modification time and size of the file.'''
+        stat=os.stat(key if isinstance(key,str) else key[-1])
+        return (key,stat.st_mtime_ns,stat.st_size)
+    
+    def load(self,key,loader=None):
+        '''
+        Returns the value stored for `key', loading it first if not already stored for the current version of the file.
+        If `loader' is None then `key' is a file name whose contents are read, otherwise `key' is a tuple whose last
+        value is the file name and the value is loaded by calling `loader()'.
+        '''
+        filekey=self.fileKey(key)
+        
+        with self.lock:
+            if dict.__contains__(self,filekey):
+                self.recent.move_to_end(filekey)
+                return dict.__getitem__(self,filekey)
+            
+            filelock=self.filelocks.setdefault(filekey,threading.Lock())
+            
+        with filelock:
+            with self.lock:
+                if dict.__contains__(self,filekey): # loaded by another thread while waiting for the lock
+                    self.recent.move_to_end(filekey)
+                    return dict.__getitem__(self,filekey)
+                
+            value=loader() if loader is not None else readFileContents(key)
+            size=len(value) if isinstance(value,(bytes,bytearray)) else getattr(value,'nbytes',0)
+            
+            with self.lock:
+                self.filelocks.pop(filekey,None)
+                
+                if self.current.get(key) in self.recent: # discard the value for the previous version of the file
+                    self.evict(self.current.pop(key))
+                    
+                if size<=self.maxbytes:
+                    dict.__setitem__(self,filekey,value)
+                    self.recent[filekey]=size
+                    self.current[key]=filekey
+                    self.nbytes+=size
+                    
+                    while self.nbytes>self.maxbytes:
+                        self.evict(next(iter(self.recent)))
+                
+        return value
+    
+    def evict(self,filekey):
+        '''Remove the value stored with key `filekey', this must be called with the lock held.'''
+        self.nbytes-=self.recent.pop(filekey)
+        dict.__delitem__(self,filekey)
+        
+        if self.current.get(filekey[0])==filekey:
+            del self.current[filekey[0]]
+            
+    def clear(self):
+        '''Remove all stored values.'''
+        with self.lock:
+            dict.clear(self)
+            self.recent.clear()
+            self.current.clear()
+            self.nbytes=0
+
+
+class CachedFileStore(FileStore):
+    '''
+    File store for a single readFile() call using the shared FileCache `cache'. Only the value most recently loaded 
+    through it is kept in addition to those the cache stores, so consecutive arrays in a file which is evicted from the
+    cache or too large to be stored in it read the file once, while memory use stays within the cache's budget plus the
+    size of that one value. Arrays in such a file which are separated by arrays in other files read it again.
+    '''
+    def __init__(self,cache):
+        FileStore.__init__(self)
+        self.cache=cache
+        self.last=None # the (key, value) pair most recently loaded
+        
+    def __contains__(self,key):
+        last=self.last
+        return (last is not None and last[0]==key) or key in self.cache
+    
+    def load(self,key,loader=None):
+        with self.lock:
+            filelock=self.filelocks.setdefault(key,threading.Lock())
+
+        with filelock:
+            last=self.last
+            if last is not None and last[0]==key:
+                return last[1]
+            
+            value=self.cache.load(key,loader)
+            self.last=(key,value)
+
+        return value
+
+
+def readFileContents(fullfilename):
+    '''Returns the byte contents of `fullfilename', decompressing it first if it's a .gz file.'''
+    openfunc=gzip.open if fullfilename.lower().endswith('.gz') else open
+
+    with openfunc(fullfilename,'rb') as o:
+        return o.read()
+
+
+def loadFileData(key,filestore,loader=None,stats=None):
+    '''
+    Returns the value for `key' stored in the dictionary `filestore', loading it into the dictionary first if not present.
+    If `loader' is None then `key' is a file name whose contents are read, otherwise the value is loaded by calling
+    `loader()'. If `filestore' is a FileStore the value is loaded using its thread-safe load() method. If `stats' is an
+    IOStats object the lookup is recorded and loading is timed as the "fileread" stage.
+    '''
+    if stats is not None:
+        hit=key in filestore
+        stats.recordCache(key,hit,stats.array)
+        start=stats.startTimer()
+        nbytes=0
+        try:
+            result=loadFileData(key,filestore,loader)
+            nbytes=0 if hit or loader is not None else len(result)
+        finally:
+            stats.stopTimer(start,'fileread',nbytes)
+            
+        return result
+    
+    if isinstance(filestore,FileStore):
+        return filestore.load(key,loader)
+
+    if key not in filestore:
+        filestore[key]=loader() if loader is not None else readFileContents(key)
+
+    return filestore[key]
+
+
+class GzipIndex(object):
+    '''
+    Seek point index for a gzip file, used to read a range of the uncompressed stream without decompressing the file from
+    its beginning. A seek point is placed at the start of every gzip member, files written by appending arrays with 
+    writeFile() have one member per array, and after every `spacing' uncompressed bytes within a member. The latter store
+    a copy of the decompressor state at that point so that decompression can resume from there. The index is built by
+    decompressing the file once in chunks of `chunksize' bytes without retaining its contents, and is only valid in
+    memory since decompressor states cannot be saved.
+    '''
+    def __init__(self,filename,spacing=1<<22,chunksize=1<<16):
+        self.filename=filename
+        self.spacing=spacing
+        self.chunksize=chunksize
+        self.points=[] # seek points as (uncompressed position, compressed position, decompressor or None at member start)
+        self.positions=[] # uncompressed positions of seek points for searching
+        self.size=0 # total uncompressed size
+        
+        self._build()
+        
+    @property
+    def nbytes(self):
+        '''Approximate memory size of the index, mostly the 32kB history window of each stored decompressor state.'''
+        return sum(1<<15 for p in self.points if p[2] is not None)
+        
+    def _addPoint(self,upos,cpos,decomp):
+        self.points.append((upos,cpos,decomp))
+        self.positions.append(upos)
+
+    def _decompressChunks(self,infile,decomp):
+        '''
+        Yields (compressed bytes consumed, uncompressed output, decompressor) for each step of decompressing `infile' 
+        starting with `decomp'. A new decompressor is created at the start of each member, the decompressor yielded at 
+        the end of a member is None.
+        '''
+        buf=b''
+        
+        while True:
+            if not buf:
+                buf=infile.read(self.chunksize)
+                if not buf:
+                    break
+
+            if decomp is None:
+                decomp=zlib.decompressobj(16+zlib.MAX_WBITS) # decompress gzip members
+            
+            out=decomp.decompress(buf,self.chunksize*16) # limit the output size to bound memory use
+            
+            if decomp.eof:
+                consumed=len(buf)-len(decomp.unused_data)
+                buf=decomp.unused_data
+                decomp=None
+            else:
+                consumed=len(buf)-len(decomp.unconsumed_tail)
+                buf=decomp.unconsumed_tail
+                
+            yield consumed,out,decomp
+                
+    def _build(self):
+        upos=0
+        cpos=0
+        lastpoint=0
+        self._addPoint(0,0,None)
+        
+        with open(self.filename,'rb') as o:
+            for consumed,out,decomp in self._decompressChunks(o,None):
+                upos+=len(out)
+                cpos+=consumed
+                
+                if decomp is None: # end of member, the next starts at the current position
+                    self._addPoint(upos,cpos,None)
+                    lastpoint=upos
+                elif upos-lastpoint>=self.spacing:
+                    self._addPoint(upos,cpos,decomp.copy())
+                    lastpoint=upos
+                    
+        self.size=upos
+        
+    def read(self,offset=0,size=None):
+        '''Returns `size' bytes, or up to the end if None, of the uncompressed stream starting at `offset'.'''
+        return b''.join(self.iterRead(offset,size))
+    
+    def iterRead(self,offset=0,size=None):
+        '''Yields the bytes read() returns in the chunks they're decompressed in.'''
+        end=self.size if size is None else min(offset+size,self.size)
+        index=bisect.bisect_right(self.positions,offset)-1
+        upos,cpos,decomp=self.points[index]
+        
+        with open(self.filename,'rb') as o:
+            o.seek(cpos)
+            
+            for _,out,_ in self._decompressChunks(o,decomp.copy() if decomp is not None else None):
+                start=max(0,offset-upos)
+                stop=min(len(out),end-upos)
+                
+                if stop>start:
+                    yield out[start:stop]
+                    
+                upos+=len(out)
+                
+                if upos>=end:
+                    break
+
+
+def iterChunks(buf,chunksize=CHUNKSIZE):
+    '''Yields the contents of the bytes, str, or memoryview `buf' as bytes objects of up to `chunksize' length.'''
+    for i in range(0,len(buf),chunksize):
+        chunk=buf[i:i+chunksize]
+        yield chunk.tobytes() if isinstance(chunk,memoryview) else np.compat.asbytes(chunk)
+
+
+def iterBase64Decode(chunks):
+    '''Yields the decoded bytes from the iterable of base64 byte chunks `chunks', ignoring whitespace.'''
+    carry=b''
+    for chunk in chunks:
+        chunk=carry+chunk.translate(None,b' \t\r\n')
+        end=len(chunk)-len(chunk)%4 # decode only whole 4 character groups, carrying the remainder to the next chunk
+        carry=chunk[end:]
+        
+        if end:
+            yield base64.b64decode(chunk[:end])
+        
+    if carry:
+        yield base64.b64decode(carry)
+        
+
+def iterGunzip(chunks,chunksize=CHUNKSIZE):
+    '''
+    Yields the decompressed bytes from the iterable of gzip (RFC 1952) byte chunks `chunks', which may contain multiple 
+    gzip members. The output is produced in blocks of at most `chunksize' bytes.
+    '''
+    decomp=zlib.decompressobj(16+zlib.MAX_WBITS)
+    
+    for chunk in chunks:
+        while chunk:
+            yield decomp.decompress(chunk,chunksize)
+            
+            if decomp.eof: # start of the next member
+                chunk=decomp.unused_data
+                decomp=zlib.decompressobj(16+zlib.MAX_WBITS)
+            else:
+                chunk=decomp.unconsumed_tail
+                
+        
+def decodeArrayData(chunks,format_,dtype,shape,out=None,stats=None):
+    '''
+    Decode the iterable of byte chunks `chunks' in format `format_' into a new array of type `dtype' and shape `shape', 
+    or into the contiguous array `out' if given. The data is decoded and decompressed in chunks which are copied directly 
+    into the array so that the whole encoded or compressed data is never stored in memory at once. A ValueError is raised 
+    if the data doesn't match the array size. If `stats' is an IOStats object the decoding stages are timed with it.
+    '''
+    base,shuffle,codec=parseFormat(format_)
+    
+    if base==BASE64:
+        chunks=iterBase64Decode(chunks)
+        if stats is not None:
+            chunks=stats.iterTimed(chunks,'base64')
+        
+    if codec:
+        chunks=codecRegistry[codec][1](chunks)
+        if stats is not None:
+            chunks=stats.iterTimed(chunks,'decompress')
+        
+    arr=out if out is not None else np.empty(tuple(shape),dtype)
+    outbytes=arr.reshape(-1).view(np.uint8)
+    target=np.empty(len(outbytes),np.uint8) if shuffle else outbytes # shuffled data must be unshuffled into the array
+    pos=0
+    
+    with statsTimer(stats,'copy',len(outbytes)):
+        for chunk in chunks:
+            if pos+len(chunk)>len(target):
+                raise ValueError('Array data larger than array shape %r of type %r'%(arr.shape,arr.dtype))
+                
+            target[pos:pos+len(chunk)]=np.frombuffer(chunk,np.uint8)
+            pos+=len(chunk)
+            
+        if pos!=len(target):
+            raise ValueError('Array data smaller than array shape %r of type %r'%(arr.shape,arr.dtype))
+            
+        if shuffle:
+            outbytes.reshape((-1,arr.dtype.itemsize))[:]=target.reshape((arr.dtype.itemsize,-1)).T
+        
+    return arr
+
+
+def readChunkHeader(header):
+    '''
+    Returns the number of rows per chunk and the offsets and sizes of each chunk relative to the start of the data for
+    the binary_chunked_gz format, given the bytes of the header `header' which may be followed by other data. The header
+    contains the little endian 64-bit unsigned integers for the number of chunks, the rows per chunk, and the compressed 
+    size of each chunk, and is followed by the chunks each of which is a gzip member.
+    '''
+    numchunks,rows=np.frombuffer(header[:16],'<u8').astype(int)
+    sizes=np.frombuffer(header[16:16+8*numchunks],'<u8').astype(int)
+    
+    if len(sizes)!=numchunks:
+        raise ValueError('Incomplete binary_chunked_gz header')
+        
+    offsets=16+8*numchunks+np.cumsum(sizes)-sizes # one offset per chunk
+        
+    return rows,offsets,sizes
+
+
+def decodeChunkedData(dat,dtype,shape,stats=None,executor=None):
+    '''
+    Decode the bytes or memoryview `dat' in binary_chunked_gz format into a new array of type `dtype' and shape `shape'.
+    If `stats' is an IOStats object the decoding stages are timed with it. If `executor' is given the chunks are 
+    decompressed concurrently with its map method, this must use threads since the chunks are decoded into the same 
+    array, and this must not be called from within a task of `executor' itself.
+    '''
+    rows,offsets,sizes=readChunkHeader(dat)
+    arr=np.empty(tuple(shape),dtype)
+    
+    if arr.size==0: # empty arrays are stored with no chunks
+        if len(offsets)!=0:
+            raise ValueError('Chunk count does not match array shape %r'%(tuple(shape),))
+        
+        return arr
+    
+    flat=arr.reshape((arr.shape[0] if arr.ndim else 1,-1))
+    
+    if len(offsets)!=(len(flat)+rows-1)//max(1,rows):
+        raise ValueError('Chunk count does not match array shape %r'%(tuple(shape),))
+    
+    def _decodeChunk(i):
+        chunk=dat[offsets[i]:offsets[i]+sizes[i]]
+        decodeArrayData(iterChunks(chunk),BINARY_GZ,dtype,None,flat[i*rows:(i+1)*rows],stats)
+        
+    for _ in (executor.map if executor is not None else map)(_decodeChunk,range(len(offsets))):
+        pass
+        
+    return arr
+        
+
+def readArrayData(shape,dimorder,type_,format_,offset,size,fullfilename,sep,text,filestore,mmap=False,gzindex=False,stats=None,executor=None):
+    '''
+    Read the data for an array from the file `fullfilename' if given otherwise from the `text' string value. If `mmap' is
+    True then binary data in an uncompressed file is memory-mapped rather than read, returning a read-only array view of
+    the file. If `mmap' is "c" the mapping is copy-on-write so the array can be modified without altering the file. If
+    `gzindex' is True then non-text data in a .gz file is read using a GzipIndex stored in `filestore' rather than 
+    decompressing the whole file into it. If `stats' is an IOStats object the stages of reading are recorded with it. 
+    The chunks of binary_chunked_gz data are decompressed concurrently by thread pool `executor' if given, see 
+    decodeChunkedData().
+    '''
+    assert isValidFormat(format_), 'Invalid array format: %r'%format_
     assert shape is not None or format_ in (None,ASCII), 'Shape must be specified for non-ascii data.'
     assert fullfilename or text
-    assert fullfilename or format_ not in validFormats[3:5], 'Binary data can only be stored in separate files.'
+    assert fullfilename or not isBinaryFormat(format_), 'Binary data can only be stored in separate files.'
 
     dtype_=parseType(type_)
     offset=int(offset or 0)
+    size=int(size) if size else None
     
     if shape is not None:
         shape=parseNumString(shape,int)
-        size=size or np.prod(shape)*dtype_.itemsize
+        
+        if format_ not in (None,ASCII): # text size is a line count so can't be computed from the shape
+            size=size or np.prod(shape)*dtype_.itemsize
+    
+    isCompressed=fullfilename is not None and fullfilename.lower().endswith('.gz')
     
     if format_ in (None,ASCII):
-        #arr=np.loadtxt(fullfilename or StringIO(np.compat.asunicode(text)),dtype_,skiprows=offset,delimiter=sep)
-        arr=readText(fullfilename or StringIO(np.compat.asunicode(text)),dtype_,offset,sep)
+        arr=readText(fullfilename or StringIO(np.compat.asunicode(text)),dtype_,offset,sep,shape,size,stats,filestore)
+    elif mmap and format_==BINARY and not isCompressed and np.prod(shape)>0:
+        # map the array's section of the file directly, no data is read until accessed and nothing is copied
+        with statsTimer(stats,'mmap'):
+            arr=np.memmap(fullfilename,dtype_,'c' if mmap=='c' else 'r',offset,tuple(shape))
     elif fullfilename:
-        isCompressed=fullfilename.lower().endswith('.gz')
-        openfunc=gzip.open if isCompressed else open
-        
-        # load the entirety of the file into the storage map, this can then be used later if multiple arrays are stored in it
-        if fullfilename not in filestore: 
-            with openfunc(fullfilename,'rb') as o:
-                filestore[fullfilename]=o.read()
+        if gzindex and isCompressed:
+            # decompress only the array's section of the file starting from the nearest seek point
+            index=loadFileData(('gzindex',fullfilename),filestore,lambda:GzipIndex(fullfilename),stats)
+            with statsTimer(stats,'decompress',size):
+                dat=memoryview(index.read(offset,size))
+        else:
+            # load the entirety of the file into the storage map, this can then be used later if multiple arrays are stored in it
+            dat=memoryview(loadFileData(fullfilename,filestore,None,stats))[offset:offset+size]
             
-        dat=filestore[fullfilename][offset:offset+size]
+        if format_==BINARY:
+            with statsTimer(stats,'copy',len(dat)):
+                arr=np.frombuffer(dat.tobytes(),dtype=dtype_) # copy so that the array doesn't keep the whole file in memory
+        elif format_==BINARY_CHUNKED_GZ:
+            arr=decodeChunkedData(dat,dtype_,shape,stats,executor)
+        else:
+            arr=decodeArrayData(iterChunks(dat),format_,dtype_,shape,None,stats)
+    else:
+        arr=decodeArrayData(iterChunks(text),format_,dtype_,shape,None,stats)
+
+    if shape is not None:
+        with statsTimer(stats,'reshape'):
+            arr=arr.reshape(shape)
+
+    return arr
+
+
+def sliceIndices(key,shape):
+    '''
+    Returns the indices selected in each dimension of an array of shape `shape' by the index `key' as a list of arrays, 
+    and a list of booleans stating whether each dimension is kept in the result (ie. not indexed by an integer). The key
+    may only contain integers, slices, and at most one Ellipsis, otherwise None is returned.
+    '''
+    if not isinstance(key,tuple):
+        key=(key,)
+        
+    ellipses=[i for i,k in enumerate(key) if k is Ellipsis]
+    if len(ellipses)>1:
+        return None
+    elif ellipses:
+        i=ellipses[0]
+        key=key[:i]+(slice(None),)*(len(shape)-len(key)+1)+key[i+1:]
+        
+    if len(key)>len(shape):
+        return None
+    
+    inds=[]
+    keep=[]
+    for k,n in zip(key+(slice(None),)*(len(shape)-len(key)),shape):
+        if isinstance(k,slice):
+            inds.append(np.arange(n)[k])
+            keep.append(True)
+        elif isinstance(k,(int,np.integer)) and not isinstance(k,bool):
+            if not -n<=k<n:
+                raise IndexError('Index %i is out of bounds for axis with size %i'%(k,n))
             
-        if format_ in (BASE64,BASE64_GZ):
-            dat=base64.b64decode(dat)
+            inds.append(np.asarray([k%n]))
+            keep.append(False)
+        else:
+            return None
         
-        if format_ in (BASE64_GZ,BINARY_GZ):
-            dat=gzip.GzipFile(fileobj=BytesIO(dat)).read() # RFC 1952
+    return inds,keep
+
+
+def getSliceSelection(key,shape,format_,fullfilename,gzindex=False):
+    '''
+    Returns the selection of the array with the given shape, format, and file name given by `key' as returned by 
+    sliceIndices() if readArrayDataSlice() can read the selection without reading the whole array, None otherwise.
+    '''
+    isCompressed=fullfilename is not None and fullfilename.lower().endswith('.gz')
+    
+    if format_ not in (BINARY,BINARY_CHUNKED_GZ) or not fullfilename or shape is None:
+        return None
+    elif isCompressed and (format_==BINARY_CHUNKED_GZ or not gzindex):
+        return None
+    
+    selection=sliceIndices(key,tuple(parseNumString(shape,int)))
+    
+    if selection is None or (format_==BINARY_CHUNKED_GZ and not selection[0]):
+        return None
+    
+    return selection
 
-        arr=np.frombuffer(dat,dtype=dtype_)
+
+def readArrayDataSlice(key,shape,dimorder,type_,format_,offset,size,fullfilename,sep,text,filestore,mmap=False,gzindex=False,stats=None):
+    '''
+    Read the part of an array selected by the index `key', the other arguments being those of readArrayData(). If the
+    array is binary data in an uncompressed file, or in a .gz file and `gzindex' is True, only the ranges of bytes 
+    containing the selection are read. For binary_chunked_gz arrays in uncompressed files only the chunks containing the 
+    selected rows are read and decompressed. The innermost dimensions which are wholly selected are contiguous in the file
+    so form a single run of bytes for each combination of indices in the outer dimensions, eg. `arr[t,z0:z1]' of a 4D 
+    array is one run. Runs of at least SLICERUNBYTES are read individually, or decompressed in one pass over the file for
+    .gz files, otherwise the span of rows in the first dimension containing the selection is read at once and indexed in
+    memory, eg. `arr[...,t]' reads the whole array once. For other arrays or keys which aren't integers, slices, and 
+    Ellipsis, the whole array is read with readArrayData() and then indexed with `key'.
+    '''
+    isCompressed=fullfilename is not None and fullfilename.lower().endswith('.gz')
+    selection=getSliceSelection(key,shape,format_,fullfilename,gzindex)
+        
+    if selection is None:
+        return readArrayData(shape,dimorder,type_,format_,offset,size,fullfilename,sep,text,filestore,mmap,gzindex,stats)[key]
+    
+    inds,keep=selection
+    shape=tuple(parseNumString(shape,int))
+    dtype_=parseType(type_)
+    offset=int(offset or 0)
+    
+    if format_==BINARY_CHUNKED_GZ:
+        return readChunkedSlice(inds,keep,shape,dtype_,offset,fullfilename,stats)
+    strides=[int(np.prod(shape[d+1:])) for d in range(len(shape))] # element strides for each dimension
+    outshape=tuple(len(i) for i in inds)
+    keepshape=tuple(n for n,k in zip(outshape,keep) if k)
+    
+    if 0 in outshape:
+        return np.empty(keepshape,dtype_)
+    
+    # find the first dimension `c' of the innermost dimensions which are wholly selected
+    c=len(shape)
+    while c>0 and np.array_equal(inds[c-1],np.arange(shape[c-1])):
+        c-=1
+        
+    # the range in dimension c-1 spanning its selected indices, the whole array if every dimension is selected
+    lo,hi=(int(inds[c-1].min()),int(inds[c-1].max())+1) if c else (0,1)
+    runlen=(hi-lo)*(strides[c-1] if c else int(np.prod(shape)))
+    outer=inds[:max(0,c-1)]
+    
+    index=loadFileData(('gzindex',fullfilename),filestore,lambda:GzipIndex(fullfilename),stats) if isCompressed else None
+    stage='decompress' if isCompressed else 'fileread'
+    
+    def _readRange(start,out):
+        '''Read bytes starting from `start' in the file into the uint8 array `out'.'''
+        with statsTimer(stats,stage,len(out)):
+            if index is not None:
+                dat=np.frombuffer(index.read(start,len(out)),np.uint8)
+                out[:len(dat)]=dat
+                numread=len(dat)
+            else:
+                infile.seek(start)
+                numread=infile.readinto(out)
+        
+        if numread!=len(out):
+            raise ValueError('Array data in %r smaller than array shape %r'%(fullfilename,shape))
+    
+    with open(fullfilename,'rb') as infile:
+        if runlen*dtype_.itemsize<SLICERUNBYTES: 
+            # read the rows of the first dimension spanning the selection in one go and index them in memory
+            first,last=int(inds[0].min()),int(inds[0].max())+1
+            result=np.empty(((last-first)*strides[0],),dtype_)
+            _readRange(offset+first*strides[0]*dtype_.itemsize,result.view(np.uint8))
+            result=result.reshape((last-first,)+shape[1:])[np.ix_(inds[0]-first,*inds[1:])]
+            return result.reshape(keepshape)
+        
+        # byte positions of each run in order of the outer dimensions' indices
+        starts=np.zeros((),np.int64)
+        for d,i in enumerate(outer):
+            starts=np.add.outer(starts,i*strides[d])
+            
+        starts=offset+(starts.ravel()+lo*(strides[c-1] if c else 0))*dtype_.itemsize
+        
+        result=np.empty(tuple(len(i) for i in outer)+(runlen,),dtype_)
+        runs=result.reshape(-1).view(np.uint8).reshape((-1,runlen*dtype_.itemsize))
+        
+        if index is None:
+            for run,start in zip(runs,starts):
+                _readRange(int(start),run)
+        else:
+            # decompress the span containing the runs once, copying each run's bytes as the stream passes over it
+            order=np.argsort(starts,kind='stable')
+            spanstart=int(starts[order[0]])
+            spanend=int(starts[order[-1]])+runs.shape[1]
+            pos=spanstart
+            r=0
+            
+            with statsTimer(stats,stage,runs.nbytes):
+                for chunk in index.iterRead(spanstart,spanend-spanstart):
+                    chunk=np.frombuffer(chunk,np.uint8)
+                    chunkend=pos+len(chunk)
+                    
+                    while r<len(order) and starts[order[r]]<chunkend:
+                        start=int(starts[order[r]])
+                        runstart=max(start,pos)
+                        runend=min(start+runs.shape[1],chunkend)
+                        runs[order[r],runstart-start:runend-start]=chunk[runstart-pos:runend-pos]
+                        
+                        if runend<start+runs.shape[1]: # run continues into the next chunk
+                            break
+                        
+                        r+=1
+                        
+                    pos=chunkend
+                    
+            if r<len(order):
+                raise ValueError('Array data in %r smaller than array shape %r'%(fullfilename,shape))
+            
+    if c:
+        result=result.reshape(tuple(len(i) for i in outer)+(hi-lo,)+shape[c:])
+        if not np.array_equal(inds[c-1],np.arange(lo,hi)): # select the indices from the read range if not contiguous
+            result=result[(slice(None),)*(c-1)+(inds[c-1]-lo,)]
     else:
-        dat=base64.b64decode(text)
+        result=result.reshape(shape)
+        
+    return result.reshape(keepshape)
+    
+    
+def readChunkedSlice(inds,keep,shape,dtype,offset,fullfilename,stats=None):
+    '''
+    Read the selection of a binary_chunked_gz array in file `fullfilename' at `offset' given by the index arrays `inds'
+    and keep values `keep' as returned by sliceIndices(). Only the chunks containing the selected rows of the first 
+    dimension are read and decompressed. If `stats' is an IOStats object the stages of reading are timed with it.
+    '''
+    outshape=tuple(n for i,n in zip(keep,map(len,inds)) if i)
+    if 0 in map(len,inds):
+        return np.empty(outshape,dtype)
+    
+    with open(fullfilename,'rb') as infile:
+        infile.seek(offset)
+        header=infile.read(16)
+        header+=infile.read(8*int(np.frombuffer(header[:8],'<u8')[0]))
+        rows,offsets,sizes=readChunkHeader(header)
+        
+        # read the chunks spanning the selected rows into a partial array starting at row `start'
+        first=int(inds[0].min())//rows
+        last=int(inds[0].max())//rows
+        start=first*rows
+        result=np.empty((min((last+1)*rows,shape[0])-start,)+shape[1:],dtype)
         
-        if format_==BASE64_GZ:
-            dat=gzip.GzipFile(fileobj=BytesIO(dat)).read()
+        for c in range(first,last+1):
+            with statsTimer(stats,'fileread',sizes[c]):
+                infile.seek(offset+offsets[c])
+                member=infile.read(sizes[c])
+                
+            decodeArrayData([member],BINARY_GZ,dtype,None,result[c*rows-start:(c+1)*rows-start],stats)
+            
+    return result[np.ix_(inds[0]-start,*inds[1:])].reshape(outshape)
+    
+
+def readArraySlice(arr,key,basepath='',filestore=None):
+    '''
+    Read the part of the data for array object `arr' selected by the index `key', with filenames relative to directory 
+    `basepath'. If the array has data this is indexed, otherwise the selection is read from its file as described for 
+    readArrayDataSlice(), with GzipIndex objects for .gz files stored in `filestore' if given.
+    '''
+    if arr.data is not None:
+        return arr.data[key]
+    
+    assert arr.filename, 'Array %r has no data or file to read from'%arr.name
+    
+    filestore=filestore if filestore is not None else {}
+    fullfilename=os.path.join(basepath,arr.filename)
+    
+    return readArrayDataSlice(key,arr.shape,arr.dimorder,arr.type,arr.format,arr.offset,arr.size,fullfilename,None,None,
+                              filestore,False,True)
+    
+
+# arguments of readArrayData() stored by LazyArray objects
+arrayargs=namedrecord('arrayargs','shape dimorder type format offset size fullfilename sep text filestore mmap gzindex stats')
+
+
+class LazyArray(NDArrayOperatorsMixin):
+    '''
+    Deferred array data which is only read and decoded when first accessed. The constructor arguments are those of
+    readArrayData(), stored as an arrayargs record, which is called by load() the first time the data is needed, either explicitly or implicitly through
+    numpy conversion, indexing, iteration, accessing attributes of the numpy array, or using arithmetic and comparison
+    operators or numpy ufuncs which are applied to the loaded array. Once loaded the arguments are
+    discarded so inline text data is freed. 
+    
+    Indexing binary arrays stored in files which aren't loaded or memory-mapped reads only the selected part of the data
+    with readArrayDataSlice() without loading the array, so each such access reads from the file. This is done only 
+    when the selection can be read without reading the whole array (see getSliceSelection), otherwise the array is 
+    loaded and then indexed so that later accesses use the loaded array.
+    '''
+    def __init__(self,*args):
+        self.args=arrayargs(*args)
+        self.arr=None
+        self.lock=threading.Lock()
+
+    @property
+    def loaded(self):
+        '''Returns True if the array data has been read.'''
+        return self.arr is not None
+
+    def load(self):
+        '''Read and return the array data, this is done only once even if called by multiple threads at once.'''
+        if self.arr is None:
+            with self.lock:
+                if self.arr is None:
+                    self.arr=readArrayData(*self.args)
+                    self.args=None
+
+        return self.arr
+    
+    async def aload(self,executor=None):
+        '''Coroutine returning the array data as load() does, calling it with `executor' or the event loop's default.'''
+        if self.arr is None:
+            await asyncio.get_running_loop().run_in_executor(executor,self.load)
             
-        arr=np.frombuffer(dat,dtype=dtype_)
+        return self.arr
+
+    def __array__(self,dtype=None,copy=None):
+        arr=self.load()
+        return arr if dtype is None else arr.astype(dtype)
+    
+    def __array_ufunc__(self,ufunc,method,*inputs,**kwargs):
+        toarray=lambda v:v.load() if isinstance(v,LazyArray) else v
+        
+        if 'out' in kwargs:
+            kwargs['out']=tuple(map(toarray,kwargs['out']))
+            
+        return getattr(ufunc,method)(*map(toarray,inputs),**kwargs)
+
+    def __getattr__(self,name):
+        if name in ('args','arr','lock'): # not yet set in the constructor, avoid recursion
+            raise AttributeError(name)
+
+        return getattr(self.load(),name)
+
+    def __getitem__(self,key):
+        args=self.args
+        if self.arr is None and args is not None and not args.mmap:
+            if getSliceSelection(key,args.shape,args.format,args.fullfilename,args.gzindex) is not None:
+                return readArrayDataSlice(key,*args)
+        
+        return self.load()[key]
+
+    def __len__(self):
+        return len(self.load())
 
-    if shape is not None:
-        arr=arr.reshape(shape)
+    def __iter__(self):
+        return iter(self.load())
 
-    return arr
+    def __repr__(self):
+        if self.arr is None:
+            return 'LazyArray(<not loaded>)'
+        else:
+            return 'LazyArray(%r)'%(self.arr,)
 
 
-def readArray(arr,basepath,filestore):
-    '''Read an array from the array XML element `arr', loading files starting from directory `basepath'.'''
+def readArray(arr,basepath,filestore,lazy=False,mmap=False,executor=None,gzindex=False,stats=None):
+    '''
+    Read an array from the array XML element `arr', loading files starting from directory `basepath'. If `lazy' is True
+    the data member of the returned array is a LazyArray object which reads the data when first accessed. The `mmap'
+    and `gzindex' values are passed to readArrayData(), as is a view of IOStats object `stats' for this array if given.
+    If `executor' is given and `lazy' is False, the data is read by submitting the call to readArrayData() to it and 
+    the data member of the returned array is the resulting Future object. If it's a ThreadPoolExecutor 
+    binary_chunked_gz arrays are instead read in this thread with their chunks decompressed by it.
+    '''
     name=arr.get('name')
     shape=arr.get('shape')
     dimorder=arr.get('dimorder')
@@ -343,19 +1923,57 @@ def readArray(arr,basepath,filestore):
     if filename:
         fullfilename=os.path.join(basepath,filename)
 
-    arr=readArrayData(shape,dimorder,type_,format_,offset,size,fullfilename,sep,text,filestore)
+    stats=stats.forArray(name) if stats is not None else None
+    args=(shape,dimorder,type_,format_,offset,size,fullfilename,sep,text,filestore,mmap,gzindex,stats)
+    
+    if lazy:
+        arr=LazyArray(*args)
+    elif format_==BINARY_CHUNKED_GZ and isinstance(executor,ThreadPoolExecutor):
+        arr=readArrayData(*args,executor=executor)
+    elif executor is not None:
+        arr=executor.submit(readArrayData,*args)
+    else:
+        arr=readArrayData(*args)
 
     return array(name, shape, dimorder, type_, format_, offset, size,filename, arr)
 
 
-def readFile(obj_or_path):
+def readFile(obj_or_path,lazy=False,mmap=False,workers=None,processes=False,gzindex=False,stats=None,filestore=None):
     '''
     Read the file path, file-like object, or XML string `obj_or_path' into a dataset object. If the XML parse fails this
     will raise a xml.etree.ElementTree.ParseError exception. If `obj_or_path' is a string but is not a path to an existing
-    file it will be treated as a XML string instead.
+    file it will be treated as a XML string instead. If `lazy' is True then the data member of each array is a LazyArray
+    object which defers reading and decoding until the data is first accessed, the other array members are available
+    immediately. If `mmap' is True then binary arrays in uncompressed files are memory-mapped as read-only arrays instead
+    of being read, or as copy-on-write arrays if `mmap' is "c". A mapped file must not be overwritten while in use.
+    
+    If `workers' is a number greater than 1 then arrays are read and decoded concurrently by a pool of that many threads,
+    or processes if `processes' is True, with the resulting arrays kept in document order. Worker threads share the same
+    file storage so each data file is still read once, whereas each worker process reads the files it needs itself. An
+    existing concurrent.futures.Executor object can also be given as `workers', in which case it isn't shut down.
+    
+    If `gzindex' is True then binary or base64 arrays stored in .gz files are read by decompressing only their section of
+    the file, starting from the nearest seek point of a GzipIndex built for the file when it's first read. This avoids
+    decompressing the whole file into memory when only some of the arrays it contains are read, eg. in lazy mode.
+    
+    The document is parsed incrementally, each top level element is converted to its object once its end tag is read 
+    and then discarded from the XML tree. This ensures the text of inline arrays isn't retained alongside the decoded 
+    array data so peak memory stays close to the size of the final dataset.
+    
+    Data files are read into a FileStore object used only by this call unless `filestore' is given, which can be a 
+    FileCache shared between calls and threads so that data files used repeatedly are read only once while unchanged.
+    
+    If `stats' is an IOStats object the time spent in each stage of reading (XML parsing, file reading, decompression, 
+    decoding, copying) is accumulated into it overall and per array, along with file cache hits and misses. Lazy arrays 
+    record their stages when they're loaded. Stats aren't collected from worker processes.
     '''
     basepath='.'
-    filestore={} # buffered storage for read file data, allows a file that is accessed multiple times to be read only once
+    executor=None
+    
+    if filestore is None:
+        filestore=FileStore() # buffered storage for read file data, allows a file that is accessed multiple times to be read only once
+    elif isinstance(filestore,FileCache):
+        filestore=CachedFileStore(filestore) # keep the last value used by this call even if it's evicted from the cache
     
     if isinstance(obj_or_path,str):
         if os.path.isfile(obj_or_path):
@@ -363,14 +1981,152 @@ def readFile(obj_or_path):
         else:
             obj_or_path=StringIO(np.compat.asunicode(obj_or_path))
             
-    root=ET.parse(obj_or_path)
-    meshes=[readMesh(m) for m in root.findall('mesh')]
-    images=[readImage(i) for i in root.findall('image')]
-    arrays=[readArray(a,basepath,filestore) for a in root.findall('array')]
-    metas=readMeta(root.findall('meta'))
+    if isinstance(workers,Executor):
+        executor=workers
+    elif workers and workers>1:
+        executor=(ProcessPoolExecutor if processes else ThreadPoolExecutor)(workers)
+        
+    meshes=[]
+    images=[]
+    arrays=ArrayList()
+    metas=[]
+    root=None
+    depth=0
+    
+    events=ET.iterparse(obj_or_path,('start','end'))
+    
+    if stats is not None:
+        events=stats.iterTimed(events,'parse')
+        
+    try:
+        for event,elem in events:
+            if event=='start':
+                root=root if root is not None else elem
+                depth+=1
+                continue
+                
+            depth-=1
+            
+            if depth!=1: # only process the direct children of the root element once they've been completely read
+                continue
+            
+            if elem.tag=='mesh':
+                meshes.append(readMesh(elem))
+            elif elem.tag=='image':
+                images.append(readImage(elem))
+            elif elem.tag=='array':
+                arrstats=None if isinstance(executor,ProcessPoolExecutor) else stats
+                arrays.append(readArray(elem,basepath,filestore,lazy,mmap,executor,gzindex,arrstats))
+            elif elem.tag=='meta':
+                metas+=readMeta([elem])
+                
+            root.remove(elem) # discard the element and its contents, meta objects keep references to any children they need
+    
+        # wait for the arrays being read by the executor in document order
+        for arr in arrays:
+            if isinstance(arr.data,Future):
+                arr.data=arr.data.result()
+    finally:
+        if executor is not None and executor is not workers:
+            executor.shutdown()
+
+    return dataset(meshes, images, arrays, metas)
+
+
+class HeaderTreeBuilder(object):
+    '''XMLParser target building the element tree with ET.TreeBuilder but discarding the text content of arrays.'''
+    def __init__(self):
+        self.builder=ET.TreeBuilder()
+        self.inArray=False
+        
+    def start(self,tag,attrs):
+        self.inArray=tag=='array'
+        return self.builder.start(tag,attrs)
+    
+    def end(self,tag):
+        self.inArray=False
+        return self.builder.end(tag)
+    
+    def data(self,data):
+        if not self.inArray:
+            self.builder.data(data)
+            
+    def close(self):
+        return self.builder.close()
+
+
+def getArrayNbytes(arr):
+    '''Returns the size in bytes of the data of array object `arr' computed from its shape and type, None if no shape.'''
+    if arr.shape is None:
+        return None
+    
+    return int(np.prod(parseNumString(arr.shape,int)))*parseType(arr.type).itemsize
+
 
+def scanFile(obj_or_path,chunksize=CHUNKSIZE):
+    '''
+    Read the structure of the file path, file-like object, or XML string `obj_or_path' into a dataset object without
+    reading any array data, the data member of each array is None. The document is parsed in chunks of `chunksize' 
+    bytes and the text of arrays is discarded as it's parsed, so that scanning a document with large inline arrays is
+    fast and uses little memory. The size of an array's data can be computed with getArrayNbytes().
+    '''
+    parser=ET.XMLParser(target=HeaderTreeBuilder())
+    
+    if isinstance(obj_or_path,str) and not os.path.isfile(obj_or_path):
+        parser.feed(obj_or_path)
+    else:
+        with (open(obj_or_path,'rb') if isinstance(obj_or_path,str) else contextlib.nullcontext(obj_or_path)) as o:
+            chunk=o.read(chunksize)
+            while chunk:
+                parser.feed(chunk)
+                chunk=o.read(chunksize)
+            
+    root=parser.close()
+    getattrs=lambda e:[e.get(n) for n in ('name','shape','dimorder','type','format','offset','size','filename')]
+    
+    meshes=[readMesh(e) for e in root.findall('mesh')]
+    images=[readImage(e) for e in root.findall('image')]
+    arrays=ArrayList(array(*getattrs(e)) for e in root.findall('array'))
+    metas=readMeta(root.findall('meta'))
+    
     return dataset(meshes, images, arrays, metas)
 
+
+def scanDirectory(path,pattern='*.x4df',workers=None,processes=False):
+    '''
+    Scan every file matching the glob pattern `pattern' in the directory tree rooted at `path' with scanFile(). Returns
+    an OrderedDict mapping the paths of the files in sorted order to their dataset objects, or to the exception raised
+    when scanning a file failed so that one bad file doesn't prevent the others from being catalogued. If `workers' is 
+    a number greater than 1 then files are scanned concurrently by a pool of that many threads, or processes if 
+    `processes' is True, or an existing Executor object can be given as `workers'.
+    '''
+    paths=[]
+    for dirpath,_,filenames in os.walk(path):
+        paths+=[os.path.join(dirpath,f) for f in fnmatch.filter(filenames,pattern)]
+        
+    paths.sort()
+    executor=None
+    
+    if isinstance(workers,Executor):
+        executor=workers
+    elif workers and workers>1:
+        executor=(ProcessPoolExecutor if processes else ThreadPoolExecutor)(workers)
+        
+    try:
+        mapfunc=executor.map if executor is not None else map
+        return OrderedDict(zip(paths,mapfunc(scanFileResult,paths)))
+    finally:
+        if executor is not None and executor is not workers:
+            executor.shutdown()
+            
+
+def scanFileResult(path):
+    '''Returns the result of scanFile(path), or the exception it raises.'''
+    try:
+        return scanFile(path)
+    except Exception as e:
+        return e
+
 ### Writing XML Functions
 
 class XMLStream(object):
@@ -403,6 +2159,11 @@ class XMLStream(object):
         spacing=self.sep*len(self.names)
         self.write(spacing+np.compat.asstr(val)+'\n')
 
+    def writeblock(self,val):
+        '''Write the lines of the text block `val' each with the current indentation.'''
+        spacing=self.sep*len(self.names)
+        self.write(spacing+np.compat.asstr(val).rstrip('\n').replace('\n','\n'+spacing)+'\n')
+
     @staticmethod
     @contextlib.contextmanager
     def tag(stream,name,attrs={},newlines=True):
@@ -421,15 +2182,33 @@ def toNumString(arr,dtype=float):
 
 
 def reshape2D(arr):
+    '''Reshape `arr' to 2D with the last dimension as columns, 1D arrays become a single column.'''
     shape=arr.shape
     if len(shape)==1:
-        return arr.reshape((arr.shape,1))
+        return arr.reshape((shape[0],1))
     elif len(shape)>2:
-        return arr.reshape((np.prod(shape)/shape[1],shape[1]))
+        return arr.reshape((-1,shape[-1]))
     else:
         return arr
 
 
+def iterArrayText(arr,chunksize=1<<16):
+    '''
+    Yields the text representation of array `arr' in blocks of up to `chunksize' lines. The array is reshaped with 
+    reshape2D() and each row becomes a line of space-separated values. Integers are formatted as "%d" and other types
+    with numpy's shortest round-trip string conversion, with each block's text produced by a single format operation
+    rather than formatting values individually. 
+    '''
+    arr=reshape2D(np.asarray(arr))
+    isint=arr.dtype.kind in 'iu'
+    linefmt=' '.join(['%d' if isint else '%s']*arr.shape[1])+'\n'
+    
+    for i in range(0,arr.shape[0],chunksize):
+        chunk=arr[i:i+chunksize]
+        values=chunk if isint else chunk.astype(str)
+        yield (linefmt*chunk.shape[0])%tuple(values.ravel().tolist())
+
+
 def writeMeta(obj,stream):
     '''Write a meta object tree to XML.'''
     attrs=OrderedDict(name=obj.name)
@@ -518,55 +2297,287 @@ def writeImage(obj,stream):
                 o.element('imagedata',attrs)
 
 
-def writeArrayData(data,type_,format_,outstream):
+def compressData(dat,compresslevel=COMPRESS):
+    '''Returns the bytes `dat' compressed as a gzip (RFC 1952) stream.'''
+    out=BytesIO()
+    with gzip.GzipFile(fileobj=out,mode='wb',compresslevel=compresslevel) as o:
+        o.write(dat)
+
+    return out.getvalue()
+
+
+def writeArrayData(data,type_,format_,outstream,compresslevel=None,stats=None):
     '''
     Writes the numpy array `data' to the stream `outstream' after being converted to dtype `type_' and formatted as
-    defined by `format_'. The `type_' must be a valid X4DF type and `format_' must be a member of validFormats or None in
-    which case ASCII is used. The `outstream' must be a binary stream, otherwise exceptions related to writing binary to
-    a text stream will be raised in Python 3. The `compresslevel' value is the gzip compression level used if the format
-    is a compressed type, and `b64linelen' is the length of base64 text lines (breaking base64 data into multiple lines
-    is easier to read). 
+    defined by `format_'. The `type_' must be a valid X4DF type and `format_' must be a member of validFormats, a format 
+    using a registered codec (see registerCodec), or None in which case ASCII is used. The `outstream' must be a binary 
+    stream, otherwise exceptions related to writing binary to a text stream will be raised in Python 3. The 
+    `compresslevel' value is the compression level used if the format is a compressed type, the codec's default if None.
+    If `stats' is an IOStats object the stages of encoding and writing are timed with it.
     '''
-    assert format_ is None or format_ in validFormats, 'Invalid array format: %r'%format_
+    assert isValidFormat(format_), 'Invalid array format: %r'%format_
     
-    dtype_=parseType(type_)
-    data=data.astype(dtype_)
+    for block in iterArrayData(data,type_,format_,compresslevel,stats=stats):
+        with statsTimer(stats,'write',len(block)):
+            outstream.write(np.compat.asbytes(block))
 
-    if format_ in (None,ASCII):
-        data=reshape2D(data)
-        np.savetxt(outstream,data,fmt='%s')
-    else:
-        dat=data.tobytes() # convert to binary
-        
-        # compress data with gzip RFC 1952 algorithm
-        if format_ in (BINARY_GZ, BASE64_GZ):
-            out=BytesIO()
-            gzip.GzipFile(fileobj=out,mode='wb',compresslevel=COMPRESS).write(dat)
-            dat=out.getvalue()
-        
-        # convert to base64
-        if format_ in (BASE64, BASE64_GZ):
-            dat=base64.b64encode(dat)
-            bnl=np.compat.asbytes('\n') # newline character as bytes
-
-            for i in range(0, len(dat), B64LINELEN):
-                line=dat[i:i+B64LINELEN]+bnl
-                outstream.write(line)
+
+def iterGzip(chunks,compresslevel=COMPRESS):
+    '''Yields the gzip (RFC 1952) compressed bytes of the iterable of byte chunks `chunks'.'''
+    comp=zlib.compressobj(compresslevel,zlib.DEFLATED,16+zlib.MAX_WBITS)
+    
+    for chunk in chunks:
+        out=comp.compress(chunk)
+        if out:
+            yield out
+            
+    yield comp.flush()
+    
+    
+def iterBase64Lines(chunks,linelen=B64LINELEN):
+    '''
+    Yields the base64 encoding of the iterable of byte chunks `chunks' as blocks of newline-terminated lines of length
+    `linelen'. The output is the same as encoding the whole data at once and then splitting it into lines.
+    '''
+    linebytes=linelen*3//4 # number of input bytes encoded in one line
+    carry=b''
+    
+    for chunk in itertools.chain(chunks,[None]):
+        if chunk is None: # end of input, encode the remainder as the last line
+            end=len(carry)
         else:
-            outstream.write(dat) # write whole data block
+            carry+=chunk
+            end=len(carry)-len(carry)%linebytes
 
+        if end:
+            enc=np.frombuffer(base64.b64encode(carry[:end]),np.uint8)
+            numlines=(len(enc)+linelen-1)//linelen
+            
+            # store the lines in a 2D array with an extra column for the newline characters, the last line may be short
+            lines=np.empty((numlines,linelen+1),np.uint8)
+            lines[:,-1]=ord('\n')
+            lines[:len(enc)//linelen,:-1]=enc[:(len(enc)//linelen)*linelen].reshape((-1,linelen))
+            
+            block=lines.tobytes()
+            rem=len(enc)%linelen
+            if rem: # fill in the short last line and remove the unused part of its row
+                block=block[:-(linelen+1)]+enc[-rem:].tobytes()+b'\n'
+                
+            yield block
+            
+            carry=carry[end:]
+        
 
-def writeArray(obj,stream,basepath,appendFile,overwriteFile):
-    '''Write an array to XML and store its data to file if necessary, overwriting existing if `overwriteFile'.'''
+def iterArrayData(data,type_,format_,compresslevel=None,chunksize=CHUNKSIZE,stats=None):
+    '''
+    Yields the blocks of data writeArrayData() writes for the given arguments, these are str objects for ascii format 
+    and bytes otherwise. The array's binary data is encoded and compressed in chunks of `chunksize' bytes so that the
+    whole encoded or compressed data is never stored in memory at once, except for shuffled formats which first copy
+    the array's bytes into shuffled order. If `stats' is an IOStats object the encoding stages are timed with it.
+    '''
+    base,shuffle,codec=parseFormat(format_)
+    data=np.asarray(data).astype(parseType(type_),copy=False)
+    timed=stats.iterTimed if stats is not None else lambda chunks,stage:chunks
     
-    if not obj.filename and obj.format in (BINARY,BINARY_GZ):
-        raise ValueError('Cannot store binary data in a X4DF file, must use separate data file')
+    if base==ASCII:
+        for block in timed(iterArrayText(data),'text'):
+            yield block
+        return
+    elif format_==BINARY_CHUNKED_GZ:
+        for block in timed(iterChunkedGzip(data,compresslevel,chunksize),'compress'):
+            yield block
+        return
         
-    attrs=OrderedDict({'name':obj.name})
+    dat=np.ascontiguousarray(data).reshape(-1).view(np.uint8) # binary data without copying
+    
+    # group the bytes of elements by significance, ie. all first bytes followed by all second bytes, etc.
+    if shuffle: 
+        dat=np.ascontiguousarray(dat.reshape((-1,data.dtype.itemsize)).T).reshape(-1)
+        
+    for chunk in iterEncodedChunks(iterChunks(memoryview(dat),chunksize),format_,compresslevel,stats):
+        yield chunk
 
-    if obj.shape is None and obj.format not in (None,ASCII):
-        obj.shape=toNumString(obj.data.shape,int)
+
+def iterEncodedChunks(chunks,format_,compresslevel=None,stats=None):
+    '''
+    Yields the blocks of data encoding the byte chunks of iterable `chunks' in the binary or base64 format `format_', 
+    which must not be shuffled or binary_chunked_gz. The chunks are compressed as one stream with the format's codec 
+    if it has one using compression level `compresslevel', or the codec's default if None. If `stats' is an IOStats 
+    object the encoding stages are timed with it.
+    '''
+    base,_,codec=parseFormat(format_)
+    timed=stats.iterTimed if stats is not None else lambda chunks,stage:chunks
+    
+    if codec:
+        compress,_,level,_=codecRegistry[codec]
+        chunks=timed(compress(chunks,level if compresslevel is None else compresslevel),'compress')
         
+    # convert to base64
+    if base==BASE64:
+        chunks=timed(iterBase64Lines(chunks),'base64')
+        
+    return chunks
+
+
+def iterChunkedGzip(data,compresslevel=None,chunksize=CHUNKSIZE,mapfunc=map):
+    '''
+    Yields the header and chunks of the array `data' in binary_chunked_gz format (see readChunkHeader). Each chunk is 
+    as many rows of the array's first dimension as fit in `chunksize' bytes, or one row if larger, compressed 
+    independently as a gzip member. The chunks are compressed by calling `mapfunc' with a compression function and the 
+    uncompressed chunks, eg. an executor's map method to compress chunks concurrently.
+    '''
+    compresslevel=COMPRESS if compresslevel is None else compresslevel
+    data=np.ascontiguousarray(data)
+    numrows=data.shape[0] if data.ndim else 1
+    rowbytes=data.nbytes//max(1,numrows)
+    rows=max(1,chunksize//max(1,rowbytes))
+    chunkbytes=max(1,rows*rowbytes)
+    
+    dat=memoryview(data.reshape(-1).view(np.uint8))
+    chunks=(dat[i:i+chunkbytes].tobytes() for i in range(0,len(dat),chunkbytes))
+    members=list(mapfunc(functools.partial(compressData,compresslevel=compresslevel),chunks))
+    
+    yield np.asarray([len(members),rows]+[len(m) for m in members],'<u8').tobytes()
+    
+    for member in members:
+        yield member
+
+
+def compressBlock(dat,codec,compresslevel=None):
+    '''Returns the bytes `dat' compressed as one stream with codec `codec' at `compresslevel' or its default if None.'''
+    compress,_,level,_=codecRegistry[codec]
+    return b''.join(compress([dat],level if compresslevel is None else compresslevel))
+
+
+def isBlockFormat(format_):
+    '''
+    Returns True if array data in format `format_' can be compressed in blocks concurrently by encodeArrayData(), ie. it's
+    binary_chunked_gz or its codec decompresses concatenated streams.
+    '''
+    if format_==BINARY_CHUNKED_GZ:
+        return True
+    
+    codec=parseFormat(format_)[2] if isValidFormat(format_) else None
+    return codec is not None and codecRegistry[codec][3]
+
+
+def encodeArrayData(data,type_,format_,executor=None,blocksize=None,compresslevel=None,stats=None):
+    '''
+    Returns the bytes writeArrayData() writes for the given arguments. If `executor' and `blocksize' are given and the
+    format is compressed with a codec which decompresses concatenated streams, the binary data, shuffled first if the
+    format is shuffled, is split into blocks of `blocksize' bytes which are compressed concurrently by the executor and
+    stored consecutively, eg. as gzip members, which is decompressed as one stream. The chunks of binary_chunked_gz data
+    are compressed concurrently by `executor' if given, with chunks of `blocksize' bytes if given. The `compresslevel' 
+    value is passed to iterArrayData(). If `stats' is an IOStats object the stages of encoding are timed with it. This 
+    must not be called from within a task of `executor' itself.
+    '''
+    assert isValidFormat(format_), 'Invalid array format: %r'%format_
+    
+    if format_==BINARY_CHUNKED_GZ and executor is not None:
+        data=np.asarray(data).astype(parseType(type_),copy=False)
+        with statsTimer(stats,'compress'):
+            return b''.join(iterChunkedGzip(data,compresslevel,blocksize or CHUNKSIZE,executor.map))
+    elif executor is None or not blocksize or not isBlockFormat(format_):
+        return b''.join(map(np.compat.asbytes,iterArrayData(data,type_,format_,compresslevel,stats=stats)))
+
+    base,shuffle,codec=parseFormat(format_)
+    data=np.ascontiguousarray(np.asarray(data).astype(parseType(type_),copy=False))
+    dat=data.reshape(-1).view(np.uint8)
+    
+    if shuffle: # group the bytes of elements by significance as iterArrayData() does
+        dat=dat.reshape((-1,data.dtype.itemsize)).T
+        
+    dat=np.ascontiguousarray(dat).tobytes()
+    blocks=[dat[i:i+blocksize] for i in range(0,len(dat),blocksize)] or [dat]
+    compress=functools.partial(compressBlock,codec=codec,compresslevel=compresslevel)
+    
+    with statsTimer(stats,'compress',len(dat)):
+        dat=b''.join(executor.map(compress,blocks))
+
+    if base==BASE64:
+        with statsTimer(stats,'base64',len(dat)):
+            dat=b''.join(iterBase64Lines([dat]))
+
+    return dat
+
+
+def encodeArrays(arrays,executor,window,blocksize=None,skip=lambda a:False,compresslevel=None,stats=None):
+    '''
+    Yields the encoded bytes of each array object in `arrays' in order as returned by encodeArrayData(), with up to
+    `window' arrays being encoded concurrently by `executor'. Arrays whose data is larger than `blocksize' bytes are
+    instead split into blocks compressed concurrently if their format allows this (see isBlockFormat). None is yielded for arrays for 
+    which `skip' returns True, these are not encoded. The `compresslevel' value is passed to encodeArrayData(), as is a
+    view of IOStats object `stats' for each array if given, which must be None if `executor' uses processes.
+    '''
+    arrstats=lambda arr:stats.forArray(arr.name) if stats is not None else None
+    
+    def _submit(arr):
+        if skip(arr):
+            return None
+        elif blocksize and isBlockFormat(arr.format) and np.asarray(arr.data).nbytes>blocksize:
+            return None # encoded in blocks in this thread when reached
+        else:
+            return executor.submit(encodeArrayData,np.asarray(arr.data),arr.type,arr.format,None,None,compresslevel,arrstats(arr))
+
+    arrays=iter(arrays)
+    pending=deque((a,_submit(a)) for a in itertools.islice(arrays,window))
+
+    while pending:
+        arr,result=pending.popleft()
+
+        for nextarr in itertools.islice(arrays,1):
+            pending.append((nextarr,_submit(nextarr)))
+
+        if result is not None:
+            yield result.result()
+        elif skip(arr):
+            yield None
+        else:
+            yield encodeArrayData(arr.data,arr.type,arr.format,executor,blocksize,compresslevel,arrstats(arr))
+
+
+class CountingStream(object):
+    '''Wraps the binary stream `stream' to count the number of bytes and lines written to it.'''
+    def __init__(self,stream):
+        self.stream=stream
+        self.numBytes=0
+        self.numLines=0
+
+    def write(self,dat):
+        result=self.stream.write(dat) # write first so that rejected data isn't counted
+        self.numBytes+=len(dat)
+        self.numLines+=dat.count(b'\n' if isinstance(dat,bytes) else u'\n')
+        return result
+
+
+def getFileDataSize(filename,format_):
+    '''
+    Get the size of the contents of `filename' as used for the offset of an array with format `format_', this is a line
+    count for ascii data and a byte count otherwise. For compressed files this is the uncompressed size/linecount.
+    '''
+    isCompressed=filename.lower().endswith('.gz')
+    if format_ not in (None,ASCII) and not isCompressed:
+        return os.path.getsize(filename)
+    
+    openfunc=gzip.open if isCompressed else open
+    
+    with openfunc(filename,'rb') as o:
+        if format_ in (None,ASCII):
+            size=sum(1 for _ in o) # count lines
+        else: # count uncompressed bytes
+            size=0
+            dat=o.read(1<<20)
+            while dat:
+                size+=len(dat)
+                dat=o.read(1<<20)
+
+    return size
+
+
+def getArrayAttrs(obj):
+    '''Returns the XML attributes of array object `obj' excluding offset and size.'''
+    attrs=OrderedDict({'name':obj.name})
+    
     if obj.shape is not None:
         attrs['shape']=obj.shape
     if obj.dimorder:
@@ -578,39 +2589,65 @@ def writeArray(obj,stream,basepath,appendFile,overwriteFile):
     if obj.filename:
         attrs['filename']=obj.filename
         
+    return attrs
+
+
+def writeArray(obj,stream,basepath,appendFile,overwriteFile,encoded=None,filepositions=None,compresslevel=None,stats=None):
+    '''
+    Write an array to XML and store its data to file if necessary, overwriting existing if `overwriteFile'. If `encoded'
+    is given this is written as the array's data instead of encoding the data with writeArrayData(), otherwise 
+    `compresslevel' is the compression level passed to it. If `stats' is an IOStats object the stages of encoding and
+    writing are timed with it for this array.
+    
+    If `appendFile' is True the data is appended to the file. The `filepositions' dictionary maps the full names of files 
+    written to in the current operation to their size in the units of the array's offset, this is used to compute the
+    offset of appended data and is updated with the new file size. If it's None or lacks the file then its existing size 
+    is measured by reading it. Files in `filepositions' are appended to even if `overwriteFile' is False since they were
+    created by the current operation. 
+    '''
+    if filepositions is None:
+        filepositions={}
+        
+    if stats is not None:
+        stats=stats.forArray(obj.name)
+    
+    if not obj.filename and isBinaryFormat(obj.format):
+        raise ValueError('Cannot store binary data in a X4DF file, must use separate data file')
+
+    if obj.shape is None and obj.format not in (None,ASCII):
+        obj.shape=toNumString(obj.data.shape,int)
+        
+    attrs=getArrayAttrs(obj)
+        
     if obj.filename: 
         filename=os.path.join(basepath,obj.filename)
         openfunc=open
         if filename.lower().endswith('.gz'): # if the file is compressed replace open with gzip using compression level 6
             openfunc=lambda f,m='rb':gzip.open(f,m,COMPRESS)
         
-        def getSize():
-            '''Get the size/linecount of the file's contents, this is uncompressed size/linecount for compressed files.'''
-            with openfunc(filename) as o:
-                if obj.format in (None,ASCII):
-                    size=sum(1 for _ in o) # count lines
-                else: # count uncompressed bytes
-                    size=0
-                    dat=o.read(1024)
-                    while dat:
-                        size+=len(dat)
-                        dat=o.read(1024)
-            
-            return size
-        
-        if overwriteFile or not os.path.isfile(filename):
+        if overwriteFile or filename in filepositions or not os.path.isfile(filename):
             mode='wb'
             obj.offset=0
             
             # if appending to existing file, choose mode and offset
             if appendFile: 
                 mode='ab'
-                obj.offset=getSize()
+                if filename not in filepositions:
+                    filepositions[filename]=getFileDataSize(filename,obj.format)
+                    
+                obj.offset=filepositions[filename]
                 
+            # count what's written to compute the size, this is uncompressed size/linecount for compressed files
             with openfunc(filename,mode) as out:
-                writeArrayData(obj.data,obj.type,obj.format,out)
+                out=CountingStream(out)
+                if encoded is not None:
+                    with statsTimer(stats,'write',len(encoded)):
+                        out.write(encoded)
+                else:
+                    writeArrayData(obj.data,obj.type,obj.format,out,compresslevel,stats)
                 
-            obj.size=getSize()-obj.offset
+            obj.size=out.numLines if obj.format in (None,ASCII) else out.numBytes
+            filepositions[filename]=obj.offset+obj.size
                     
         if obj.offset is not None:
             attrs['offset']=obj.offset
@@ -621,19 +2658,50 @@ def writeArray(obj,stream,basepath,appendFile,overwriteFile):
         stream.element('array',attrs)
     else:
         with XMLStream.tag(stream,'array',attrs) as o:
-            out=BytesIO()
-            writeArrayData(obj.data,obj.type,obj.format,out)
-            dat=np.compat.asstr(out.getvalue())
-            dat=dat.strip().split('\n')
-            for line in dat:
-                o.writeline(line.strip())
+            # write text or base64 blocks directly into the document as they're encoded
+            blocks=[encoded] if encoded is not None else iterArrayData(obj.data,obj.type,obj.format,compresslevel,stats=stats)
+            for block in blocks:
+                if block:
+                    with statsTimer(stats,'write',len(block)):
+                        o.writeblock(block)
 
 
-def writeFile(obj,obj_or_path,overwriteFiles=True):
-    '''Write the x4df object to the path or file-like object `obj_or_path'. Data files are overwritten if `overwriteFiles'.'''
+def writeFile(obj,obj_or_path,overwriteFiles=True,workers=None,processes=False,blocksize=None,compresslevel=None,stats=None):
+    '''
+    Write the x4df object to the path or file-like object `obj_or_path'. Data files are overwritten if `overwriteFiles'.
+    
+    If `workers' is a number greater than 1 then arrays are encoded and compressed concurrently by a pool of that many 
+    threads, or processes if `processes' is True, and written in their original order. An existing Executor object can 
+    also be given as `workers' in which case it isn't shut down. When using workers and `blocksize' is given, arrays with
+    compressed formats larger than `blocksize' bytes are split into blocks compressed in parallel (see encodeArrayData).
+    
+    The `compresslevel' value is the compression level used for arrays with compressed formats, if None the default 
+    level for each format's codec is used (see registerCodec).
+    
+    If `stats' is an IOStats object the time spent in each stage of writing (text formatting, compression, base64 
+    encoding, writing) is accumulated into it overall and per array. Stats aren't collected from worker processes.
+    '''
     basepath=os.path.dirname(obj_or_path) if isinstance(obj_or_path,str) else os.getcwd()
     stream=obj_or_path
     filenames=set()
+    filepositions={} # sizes of data files written to, used to compute offsets without reading files
+    arrays=obj.arrays or []
+    encoded=itertools.repeat(None) # no pre-encoded data unless using workers
+    executor=None
+
+    if isinstance(workers,Executor):
+        executor=workers
+        window=2*(os.cpu_count() or 1)
+    elif workers and workers>1:
+        executor=(ProcessPoolExecutor if processes else ThreadPoolExecutor)(workers)
+        window=2*workers
+        
+    if executor is not None:
+        # skip encoding arrays whose existing files won't be overwritten
+        existing={a.filename for a in arrays if a.filename and os.path.isfile(os.path.join(basepath,a.filename))}
+        skip=lambda a:not overwriteFiles and a.filename in existing
+        encstats=None if isinstance(executor,ProcessPoolExecutor) else stats
+        encoded=encodeArrays(arrays,executor,window,blocksize,skip,compresslevel,encstats)
 
     if isinstance(obj_or_path,str):
         stream=open(obj_or_path,'w')
@@ -648,8 +2716,8 @@ def writeFile(obj,obj_or_path,overwriteFiles=True):
             for image in (obj.images or []):
                 writeImage(image,ostream)
 
-            for array in (obj.arrays or []):
-                writeArray(array,ostream,basepath,array.filename in filenames,overwriteFiles)
+            for array,enc in zip(arrays,encoded):
+                writeArray(array,ostream,basepath,array.filename in filenames,overwriteFiles,enc,filepositions,compresslevel,stats)
                 if array.filename:
                     filenames.add(array.filename)
 
@@ -657,6 +2725,398 @@ def writeFile(obj,obj_or_path,overwriteFiles=True):
     finally:
         if isinstance(obj_or_path,str):
             stream.close()
+            
+        if executor is not None and executor is not workers:
+            executor.shutdown()
+
+
+def appendToFile(obj,path,compresslevel=None,stats=None):
+    '''
+    Append the contents of dataset `obj' to the existing X4DF document at `path' without rewriting existing data files.
+    Meshes and images in `obj' with the name of an existing mesh or image have their nodes, topologies, fields, and 
+    imagedata members added to it, others are added as new. The data of arrays with files is appended to their files,
+    including those storing existing arrays, with offsets computed from the size of the data in the files as measured 
+    by getFileDataSize(). This reads compressed and text files but ensures new data is placed after any data not in 
+    the document, eg. written by an earlier append which failed before replacing the document. A ValueError is raised if an array's name is already used. The existing elements of the document are copied
+    unchanged, including inline array text which isn't decoded, so the cost of appending is that of writing the new 
+    data and rewriting the XML document. This is written to a temporary file first which then replaces the original.
+    The `compresslevel' and `stats' values are used as in writeFile().
+    '''
+    root=ET.parse(path).getroot()
+    basepath=os.path.dirname(path)
+    filepositions={} # sizes of data files in the units of the offsets of arrays stored in them
+    formats={} # formats of the existing arrays stored in each data file, which determine the units of their offsets
+    names={e.get('name') for e in root.findall('array')}
+    tmppath=path+'.tmp'
+    childorders={'mesh':('timescheme','nodes','topology','field','meta'),'image':('timescheme','transform','imagedata','meta')}
+    
+    for elem in root.findall('array'):
+        if elem.get('filename'):
+            formats.setdefault(os.path.join(basepath,elem.get('filename')),elem.get('format'))
+        
+    for arr in (obj.arrays or []):
+        if arr.name in names:
+            raise ValueError('Array name %r already present in %r'%(arr.name,path))
+        
+        names.add(arr.name)
+        
+        if arr.filename:
+            filename=os.path.join(basepath,arr.filename)
+            if filename not in filepositions and os.path.isfile(filename): # measure the file rather than trust the document
+                filepositions[filename]=getFileDataSize(filename,formats.get(filename,arr.format))
+                
+    def _toElement(writefunc,newobj):
+        out=StringIO()
+        writefunc(newobj,XMLStream(out))
+        return ET.fromstring(out.getvalue())
+    
+    def _insertChild(parent,child):
+        order=childorders[parent.tag]
+        pos=0 # insert after the last child which comes before or is the same as the new child in the schema order
+        for i,c in enumerate(parent):
+            if c.tag in order and order.index(c.tag)<=order.index(child.tag):
+                pos=i+1
+                
+        if len(parent) and pos==len(parent): # the last child's tail is the indentation of the parent's end tag
+            child.tail=parent[-1].tail
+            parent[-1].tail=parent.text
+        else:
+            child.tail=parent.text
+            
+        parent.insert(pos,child)
+    
+    # add the members of new meshes and images to existing elements with the same name, others are written as new
+    newobjs=[]
+    for tag,objs,writefunc in (('mesh',obj.meshes,writeMesh),('image',obj.images,writeImage)):
+        existing={e.get('name'):e for e in root.findall(tag)}
+        
+        for newobj in (objs or []):
+            if newobj.name not in existing:
+                newobjs.append((writefunc,newobj))
+            elif tag=='mesh':
+                members=mesh(newobj.name,None,newobj.nodes or [],newobj.topologies,newobj.fields)
+                for child in _toElement(writeMesh,members):
+                    _insertChild(existing[newobj.name],child)
+            else:
+                for child in _toElement(writeImage,image(newobj.name,None,None,newobj.imagedata or [])):
+                    _insertChild(existing[newobj.name],child)
+
+    try:
+        with open(tmppath,'w') as stream:
+            stream.write(u'<?xml version="1.0" encoding="UTF-8"?>\n')
+            
+            with XMLStream.tag(stream,'x4df') as ostream:
+                for elem in root:
+                    elem.tail='\n'
+                    ostream.writeline(ET.tostring(elem,encoding='unicode').rstrip('\n'))
+                    
+                for writefunc,newobj in newobjs:
+                    writefunc(newobj,ostream)
+    
+                for array in (obj.arrays or []):
+                    filename=os.path.join(basepath,array.filename or '')
+                    writeArray(array,ostream,basepath,filename in filepositions,True,None,filepositions,compresslevel,stats)
+    
+                writeMetas(obj.metas,ostream)
+                
+        os.replace(tmppath,path)
+    finally:
+        if os.path.isfile(tmppath):
+            os.remove(tmppath)
+
+
+class X4DFWriter(object):
+    '''
+    Writes a X4DF document to the path or file-like object `obj_or_path' incrementally so that its array data need never
+    be in memory all at once. Arrays are written by addArray() as their data is produced, meshes, images and metas are
+    added with addMesh(), addImage(), and addMeta() and written when close() is called, which is done on exiting when 
+    used as a context manager. Data files are overwritten when first written to by the writer and appended to after. The
+    `compresslevel' and `stats' values are used as in writeFile(). For example, frames of a simulation can be written 
+    as they are computed with:
+    
+        imds=[]
+        with X4DFWriter('sim.x4df') as w:
+            for i,frame in enumerate(simulate()):
+                w.addArray('frame%i'%i,[frame],format_=BINARY_GZ,filename='sim.dat.gz')
+                imds.append(imagedata('frame%i'%i,i))
+                
+            w.addImage(image('sim',None,None,imds))
+    '''
+    def __init__(self,obj_or_path,compresslevel=None,stats=None):
+        self.compresslevel=compresslevel
+        self.stats=stats
+        self.meshes=[]
+        self.images=[]
+        self.metas=[]
+        self.arrays=[] # array objects written, without their data
+        self.filepositions={} # sizes of data files written to
+        self.basepath=os.path.dirname(obj_or_path) if isinstance(obj_or_path,str) else os.getcwd()
+        self.closeStream=isinstance(obj_or_path,str)
+        self.stream=open(obj_or_path,'w') if self.closeStream else obj_or_path
+        
+        self.stream.write(u'<?xml version="1.0" encoding="UTF-8"?>\n')
+        self.ostream=XMLStream(self.stream)
+        self.ostream.startTag('x4df')
+        
+    def __enter__(self):
+        return self
+    
+    def __exit__(self,*exc):
+        self.close()
+        
+    def addMesh(self,obj):
+        '''Add mesh object `obj' to be written when closed.'''
+        self.meshes.append(obj)
+        
+    def addImage(self,obj):
+        '''Add image object `obj' to be written when closed.'''
+        self.images.append(obj)
+        
+    def addMeta(self,obj):
+        '''Add meta object `obj' to be written when closed.'''
+        self.metas.append(obj)
+        
+    def addArray(self,name,chunks,shape=None,dimorder=None,type_=None,format_=None,filename=None):
+        '''
+        Write an array named `name' whose data is the concatenation along the first dimension of the arrays yielded by
+        the iterable `chunks', which can be a generator producing them as needed, or `chunks' can be a single array.
+        The data is converted to type `type_' and encoded as format `format_' as in writeArrayData(), but cannot use 
+        shuffled formats or binary_chunked_gz which need all the data at once. The data is stored in file `filename'
+        if given, in which case the shape is computed from the chunks if `shape' is None, otherwise the data is stored 
+        inline and `shape' must be given for formats other than ascii. Returns the array object, without data. A 
+        ValueError is raised if the chunks differ in their dimensions after the first or their number of elements isn't
+        that of `shape', in which case the array isn't added to the document. Inline data is added to the document only 
+        once it's complete for this reason.
+        '''
+        if not isValidFormat(format_):
+            raise ValueError('Invalid array format: %r'%format_)
+        
+        base,shuffle,_=parseFormat(format_)
+        
+        if shuffle or format_==BINARY_CHUNKED_GZ:
+            raise ValueError('Cannot stream array data in format %r which requires the whole array'%format_)
+        elif not filename and isBinaryFormat(format_):
+            raise ValueError('Cannot store binary data in a X4DF file, must use separate data file')
+        elif not filename and base!=ASCII and shape is None:
+            raise ValueError('Shape must be given for inline array %r'%name)
+            
+        if isinstance(chunks,np.ndarray):
+            chunks=[chunks]
+            
+        dtype=parseType(type_)
+        dims=[0,()] # length of first dimension and the remaining dimensions of the data seen so far
+        stats=self.stats.forArray(name) if self.stats is not None else None
+        obj=array(name,shape,dimorder,type_,format_,None,None,filename)
+        
+        def _iterData():
+            for chunk in chunks:
+                chunk=np.asarray(chunk).astype(dtype,copy=False)
+                chunk=chunk.reshape((1,)) if chunk.ndim==0 else chunk
+                
+                if dims[0] and chunk.shape[1:]!=dims[1]:
+                    raise ValueError('Chunk of shape %r for array %r does not match earlier chunks of shape (N,)+%r'%(chunk.shape,name,dims[1]))
+                
+                dims[0]+=chunk.shape[0]
+                dims[1]=chunk.shape[1:]
+                yield chunk
+                
+        def _checkShape():
+            numelems=dims[0]*int(np.prod(dims[1]))
+            if shape is not None and numelems!=int(np.prod(parseNumString(shape,int))):
+                raise ValueError('Array %r of shape %r written with %i elements'%(name,shape,numelems))
+                
+        if base==ASCII:
+            blocks=(block for chunk in _iterData() for block in iterArrayText(chunk))
+        else:
+            chunkbytes=(b for c in _iterData() for b in iterChunks(memoryview(np.ascontiguousarray(c).reshape(-1).view(np.uint8))))
+            blocks=iterEncodedChunks(chunkbytes,format_,self.compresslevel,stats)
+            
+        if filename:
+            fullname=os.path.join(self.basepath,filename)
+            openfunc=open
+            if fullname.lower().endswith('.gz'):
+                openfunc=lambda f,m='rb':gzip.open(f,m,COMPRESS)
+                
+            obj.offset=self.filepositions.get(fullname,0)
+            
+            with openfunc(fullname,'ab' if fullname in self.filepositions else 'wb') as out:
+                out=CountingStream(out)
+                try:
+                    for block in blocks:
+                        with statsTimer(stats,'write',len(block)):
+                            out.write(np.compat.asbytes(block))
+                finally: # data written before an error is left unused in the file so later arrays are placed after it
+                    obj.size=out.numLines if base==ASCII else out.numBytes
+                    self.filepositions[fullname]=obj.offset+obj.size
+            
+            _checkShape()
+            
+            if obj.shape is None and base!=ASCII:
+                obj.shape=toNumString((dims[0],)+dims[1],int)
+                
+            attrs=getArrayAttrs(obj)
+            attrs['offset']=obj.offset
+            attrs['size']=obj.size
+            self.ostream.element('array',attrs)
+        else:
+            out=StringIO()
+            inline=XMLStream(out,self.ostream.sep)
+            inline.names=list(self.ostream.names) # indent as if written to the document
+            
+            with XMLStream.tag(inline,'array',getArrayAttrs(obj)) as o:
+                for block in blocks:
+                    if block:
+                        with statsTimer(stats,'write',len(block)):
+                            o.writeblock(block)
+                            
+            _checkShape()
+            self.stream.write(out.getvalue())
+                            
+        self.arrays.append(obj)
+        return obj
+        
+    def close(self):
+        '''Write the meshes, images and metas added to the writer and close the document, this can be called repeatedly.'''
+        if self.ostream is None:
+            return
+        
+        try:
+            for mesh in self.meshes:
+                writeMesh(mesh,self.ostream)
+                
+            for image in self.images:
+                writeImage(image,self.ostream)
+                
+            writeMetas(self.metas,self.ostream)
+            self.ostream.endTag()
+        finally:
+            self.ostream=None
+            if self.closeStream:
+                self.stream.close()
+
+
+### Asynchronous Functions
+
+async def areadFile(obj_or_path,executor=None,**kwargs):
+    '''
+    Coroutine reading `obj_or_path' with readFile() and the given keyword arguments in `executor', or the event loop's
+    default executor if None, so that the event loop isn't blocked by parsing, reading, and decoding. The number of 
+    reads in progress at once is bounded by the number of workers `executor' has.
+    '''
+    return await asyncio.get_running_loop().run_in_executor(executor,functools.partial(readFile,obj_or_path,**kwargs))
+
+
+async def awriteFile(obj,obj_or_path,executor=None,**kwargs):
+    '''Coroutine writing `obj' to `obj_or_path' with writeFile() and the given keyword arguments in `executor'.'''
+    return await asyncio.get_running_loop().run_in_executor(executor,functools.partial(writeFile,obj,obj_or_path,**kwargs))
+
+
+def iterFileRange(fullfilename,offset=0,size=None,chunksize=CHUNKSIZE):
+    '''Yields the bytes of `fullfilename' from `offset' for `size' bytes, or up to the end if None, in `chunksize' reads.'''
+    with open(fullfilename,'rb') as o:
+        o.seek(offset)
+        while size is None or size>0:
+            chunk=o.read(chunksize if size is None else min(chunksize,size))
+            if not chunk:
+                break
+            
+            size=None if size is None else size-len(chunk)
+            yield chunk
+
+
+async def astreamArray(arr,basepath='',executor=None,filestore=None,chunksize=CHUNKSIZE):
+    '''
+    Asynchronous generator yielding the bytes of the data for array object `arr' in C order in chunks of up to about
+    `chunksize' bytes, with the file, if any, relative to directory `basepath'. This is intended for sending an array
+    in a response without blocking the event loop, each chunk is read in `executor', or the loop's default if None. 
+    Binary arrays stored in files without data or whose data is a LazyArray which isn't loaded, as returned by 
+    areadFile() with `lazy' True, are read from the file a chunk at a time, using a GzipIndex stored in `filestore' for 
+    .gz files, so neither the array nor the file is read into memory at once. Other arrays are read and decoded in 
+    `executor' if they have no data or their data is a LazyArray, and their bytes yielded.
+    '''
+    loop=asyncio.get_running_loop()
+    unloaded=arr.data is None or (isinstance(arr.data,LazyArray) and not arr.data.loaded)
+    
+    if unloaded and arr.filename and arr.format==BINARY:
+        fullfilename=os.path.join(basepath,arr.filename)
+        offset=int(arr.offset or 0)
+        size=int(arr.size) if arr.size else None
+        
+        if size is None and arr.shape is not None:
+            size=int(np.prod(parseNumString(arr.shape,int)))*parseType(arr.type).itemsize
+        
+        if fullfilename.lower().endswith('.gz'):
+            filestore=filestore if filestore is not None else {}
+            loader=lambda:loadFileData(('gzindex',fullfilename),filestore,lambda:GzipIndex(fullfilename))
+            chunks=(await loop.run_in_executor(executor,loader)).iterRead(offset,size)
+        else:
+            chunks=iterFileRange(fullfilename,offset,size,chunksize)
+        
+        while True:
+            chunk=await loop.run_in_executor(executor,next,chunks,None)
+            if chunk is None:
+                break
+            
+            yield chunk
+    else:
+        if isinstance(arr.data,LazyArray):
+            data=await arr.data.aload(executor)
+        elif arr.data is None:
+            data=await loop.run_in_executor(executor,readArraySlice,arr,slice(None),basepath,filestore)
+        else:
+            data=arr.data
+            
+        for chunk in iterChunks(memoryview(np.ascontiguousarray(data).reshape(-1).view(np.uint8)),chunksize):
+            yield chunk
+
+
+### Compression Codecs
+
+registerCodec('gz',iterGzip,iterGunzip,COMPRESS,True) # gzip (RFC 1952)
+
+registerCodec('zlib', # zlib (RFC 1950) without the gzip wrapper
+    lambda chunks,level:iterCompressor(chunks,zlib.compressobj(level)),
+    lambda chunks:iterDecompressor(chunks,zlib.decompressobj),
+    COMPRESS,
+    True
+)
+
+try:
+    import lzma
+    registerCodec('lzma', # xz format
+        lambda chunks,level:iterCompressor(chunks,lzma.LZMACompressor(preset=level)),
+        lambda chunks:iterDecompressor(chunks,lzma.LZMADecompressor),
+        6,
+        True
+    )
+except ImportError:
+    pass
+
+try:
+    import zstandard
+    registerCodec('zstd',
+        lambda chunks,level:iterCompressor(chunks,zstandard.ZstdCompressor(level=level).compressobj()),
+        lambda chunks:iterDecompressor(chunks,lambda:zstandard.ZstdDecompressor().decompressobj()),
+        3,
+        True
+    )
+except ImportError:
+    pass
+
+try:
+    import lz4.frame
+    
+    def iterLZ4(chunks,level):
+        '''Yields the LZ4 frame compressed bytes of `chunks'.'''
+        comp=lz4.frame.LZ4FrameCompressor(compression_level=level)
+        yield comp.begin()
+        
+        for out in iterCompressor(chunks,comp):
+            yield out
+        
+    registerCodec('lz4',iterLZ4,lambda chunks:iterDecompressor(chunks,lz4.frame.LZ4FrameDecompressor),0,True)
+except ImportError:
+    pass
 
 
 if __name__=='__main__':